@@ -0,0 +1,308 @@
+# api/bench_ingest.py
+"""
+📊 업로드 파이프라인 벤치마크 (로컬 실행용, DB/네트워크 불필요)
+
+    cd api && pip install -r requirements-bench.txt         # xls 생성용 xlwt 포함
+    python bench_ingest.py                                 # 기본: 1k/100k 행, 규칙 10/500/5000
+    python bench_ingest.py --rows 1k,100k,1m --formats xlsx,csv --layouts woori
+    python bench_ingest.py --json bench.json               # 결과 저장 (회귀 비교용)
+
+단계별 (load → unify → normalize_vendor → compile_rules → apply_rules) 처리 속도(rows/s)와
+단계 중 최대 RSS 증가량(MB)을 출력한다.
+- 합성 파일은 --data-dir 에 캐시 (같은 시드/행 수면 재생성하지 않음)
+- xls 합성 파일은 xlwt(requirements-bench.txt) 로 생성, BIFF 한계로 65,535행까지.
+  xlwt 가 없으면 xls 는 측정하지 않고 결과표 맨 위에 "xls skipped" 줄을 남긴다
+"""
+import os
+import io
+import gc
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import importlib.util
+import tempfile
+import threading
+import resource
+import contextlib
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Tuple
+
+import pandas as pd
+
+from utils import (
+    iter_spreadsheet, iter_unified, normalize_vendor_series, compile_rules, apply_rules_df,
+    _normalize_vendor_cached,
+)
+
+XLS_MAX_ROWS = 65535 - 10
+
+VENDORS = [
+    "스타벅스", "이디야커피", "투썸플레이스", "GS25", "CU", "세븐일레븐", "이마트", "홈플러스", "쿠팡",
+    "배달의민족", "요기요", "카카오페이", "네이버페이", "토스", "KT", "SKT", "LG유플러스", "한국전력",
+    "국민연금", "건강보험", "다이소", "올리브영", "무신사", "교보문고", "맥도날드", "버거킹", "파리바게뜨",
+]
+FIXED = ["임대료", "관리비", "월급", "통신비", "보험료", "정수기렌탈", "세무사수수료"]
+PEOPLE = ["김철수", "이영희", "박민수", "최지은", "정하늘", "강도윤", "윤서준"]
+BRANCHES = ["강남", "역삼", "홍대", "잠실", "분당", "판교"]
+
+
+# =========================
+# 합성 거래내역 생성
+# =========================
+def _descriptions(rng: random.Random, n: int) -> List[str]:
+    """실제 통장처럼 같은 거래처가 반복되되 지점/번호가 붙어 고유값도 충분히 섞이게"""
+    out = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.55:
+            out.append(f"{rng.choice(VENDORS)} {rng.choice(BRANCHES)}점")
+        elif r < 0.70:
+            out.append(f"{rng.choice(VENDORS)}_{rng.randint(1000, 99999)}")
+        elif r < 0.85:
+            out.append(rng.choice(FIXED))
+        else:
+            out.append(rng.choice(PEOPLE))
+    return out
+
+
+def _amounts(rng: random.Random, n: int) -> List[Tuple[bool, int]]:
+    return [(rng.random() < 0.3, rng.randint(1, 5000) * 100) for _ in range(n)]
+
+
+def rows_woori(n: int, seed: int = 1) -> Tuple[List[list], str]:
+    rng = random.Random(seed)
+    rows = [
+        ["우리은행 거래내역조회", None, None, None, None, None, None],
+        ["계좌번호", "1005-123-456789", None, None, None, None, None],
+        ["조회기간", "2020.01.01 ~ 2024.12.31", None, None, None, None, None],
+        [None] * 7,
+        ["거래일시", "적요", "기재내용", "지급(원)", "입금(원)", "거래후 잔액(원)", "취급점"],
+    ]
+    bal, d = 50_000_000, datetime(2020, 1, 1, 9)
+    for desc, (inn, amt) in zip(_descriptions(rng, n), _amounts(rng, n)):
+        d += timedelta(minutes=rng.randint(1, 180))
+        bal += amt if inn else -amt
+        rows.append([
+            d.strftime("%Y.%m.%d %H:%M:%S"), rng.choice(["체크카드", "인터넷", "모바일", "자동이체"]), desc,
+            "0" if inn else f"{amt:,}", f"{amt:,}" if inn else "0", f"{bal:,}", rng.choice(BRANCHES),
+        ])
+    return rows, "cp949"
+
+
+def rows_kb(n: int, seed: int = 2) -> Tuple[List[list], str]:
+    rng = random.Random(seed)
+    rows = [
+        ["KB국민은행 거래내역", None, None, None, None, None, None],
+        ["계좌번호", "123456-01-234567", None, None, None, None, None],
+        ["거래일시", "적요", "보낸분/받는분", "출금액(원)", "입금액(원)", "잔액(원)", "송금메모"],
+    ]
+    bal, d = 30_000_000, datetime(2020, 1, 1, 9)
+    for desc, (inn, amt) in zip(_descriptions(rng, n), _amounts(rng, n)):
+        d += timedelta(minutes=rng.randint(1, 180))
+        bal += amt if inn else -amt
+        rows.append([
+            d.strftime("%Y.%m.%d %H:%M:%S"), rng.choice(["전자금융", "체크카드", "타행이체"]), desc,
+            "0" if inn else str(amt), str(amt) if inn else "0", str(bal), rng.choice(["", "", "회비", "정산"]),
+        ])
+    return rows, "cp949"
+
+
+def rows_generic(n: int, seed: int = 3) -> Tuple[List[list], str]:
+    rng = random.Random(seed)
+    rows = [["거래내역", None, None, None, None, None], [None] * 6, ["날짜", "내용", "입금", "출금", "잔액", "메모"]]
+    bal, d = 10_000_000, datetime(2020, 1, 1)
+    for desc, (inn, amt) in zip(_descriptions(rng, n), _amounts(rng, n)):
+        d += timedelta(minutes=rng.randint(1, 180))
+        bal += amt if inn else -amt
+        rows.append([
+            d.strftime("%Y-%m-%d"), desc, f"₩{amt:,}" if inn else "", "" if inn else f"{amt:,}원", f"{bal:,}",
+            rng.choice(["", "", "카드", "이체"]),
+        ])
+    return rows, "utf-8-sig"
+
+
+GENERATORS: Dict[str, Callable[[int], Tuple[List[list], str]]] = {
+    "woori": rows_woori,
+    "kb": rows_kb,
+    "generic": rows_generic,
+}
+
+
+def write_statement(rows: List[list], encoding: str, fmt: str, path: str) -> None:
+    if fmt == "xlsx":
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        for r in rows:
+            ws.append(r)
+        wb.save(path)
+    elif fmt == "xls":
+        import xlwt
+        wb = xlwt.Workbook()
+        ws = wb.add_sheet("Sheet1")
+        for i, r in enumerate(rows):
+            for j, v in enumerate(r):
+                if v is not None:
+                    ws.write(i, j, v)
+        wb.save(path)
+    elif fmt == "csv":
+        with open(path, "w", newline="", encoding=encoding, errors="replace") as f:
+            csv.writer(f).writerows(rows)
+    else:
+        raise ValueError(fmt)
+
+
+def ensure_file(data_dir: str, layout: str, fmt: str, n: int) -> str:
+    path = os.path.join(data_dir, f"{layout}_{n}.{fmt}")
+    if not os.path.exists(path):
+        t0 = time.perf_counter()
+        rows, enc = GENERATORS[layout](n)
+        write_statement(rows, enc, fmt, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        print(f"  🛠️  생성 {os.path.basename(path)} ({time.perf_counter() - t0:.1f}s)", file=sys.stderr)
+    return path
+
+
+def make_rules(n: int, seed: int = 7) -> List[dict]:
+    """거래처/고정비 키워드 + 매칭되지 않는 임의 키워드를 섞은 우선순위 내림차순 규칙"""
+    rng = random.Random(seed)
+    real = VENDORS + FIXED + PEOPLE
+    rules = []
+    for i in range(n):
+        kw = real[i] if i < len(real) else f"{rng.choice(real)}{rng.randint(0, 10 ** 6)}"
+        rules.append({
+            "keyword": kw,
+            "target": rng.choice(["any", "any", "description", "vendor", "memo"]),
+            "category": f"카테고리{i % 40}",
+            "is_fixed": kw in FIXED,
+            "priority": n - i,
+        })
+    return rules
+
+
+# =========================
+# 측정
+# =========================
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:  # /proc 없는 환경 → 최대 RSS 로 근사
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakRSS:
+    """단계 실행 중 RSS 를 주기적으로 샘플링해 시작 대비 최대 증가량 측정"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def __enter__(self):
+        gc.collect()
+        self.start = self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    @property
+    def delta_mb(self) -> float:
+        return (self.peak - self.start) / 2 ** 20
+
+
+def measure(stage: str, rows: int, fn: Callable[[], Any], results: List[dict], ctx: Dict[str, Any]) -> Any:
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # 파서 진행 로그(print) 숨김
+            out = fn()
+        sec = time.perf_counter() - t0
+    rec = {**ctx, "stage": stage, "rows": rows, "seconds": round(sec, 4),
+           "rows_per_sec": round(rows / sec) if sec > 0 else None, "peak_mb": round(mem.delta_mb, 1)}
+    results.append(rec)
+    rps = f"{rec['rows_per_sec']:>12,}" if rec["rows_per_sec"] else f"{'-':>12}"
+    label = f"{ctx['layout']}/{ctx['format']}/{ctx['n']}"
+    extra = f" rules={ctx['rules']}" if "rules" in ctx else ""
+    print(f"{label:<22} {stage + extra:<30} {sec:>9.3f}s {rps} rows/s {mem.delta_mb:>8.1f} MB")
+    return out
+
+
+def bench_file(path: str, layout: str, fmt: str, n: int, rule_sets: Dict[int, List[dict]], results: List[dict]):
+    ctx = {"layout": layout, "format": fmt, "n": n}
+    with open(path, "rb") as fh:
+        content = io.BytesIO(fh.read())
+
+    meta: Dict[str, Any] = {}
+    frames = measure("load", n, lambda: list(iter_spreadsheet(content, path, meta=meta)), results, ctx)
+    df = measure("unify", n, lambda: pd.concat(list(iter_unified(iter(frames), meta=meta)), ignore_index=True), results, ctx)
+    frames = None  # 원본 배치 해제 → 이후 단계 측정에 섞이지 않게
+    if meta.get("layout") != layout:
+        print(f"  ⚠️ 레이아웃 감지 불일치: 기대 {layout} → {meta.get('layout')}", file=sys.stderr)
+
+    _normalize_vendor_cached.cache_clear()  # 요청 간 LRU 없이 측정
+    df["vendor_normalized"] = measure("normalize_vendor", len(df), lambda: normalize_vendor_series(df["description"]), results, ctx)
+
+    for size, rules in rule_sets.items():
+        rctx = {**ctx, "rules": size}
+        compiled = measure("compile_rules", size, lambda: compile_rules(rules), results, rctx)
+        measure("apply_rules", len(df), lambda: apply_rules_df(df, compiled), results, rctx)
+
+
+def _parse_sizes(text: str) -> List[int]:
+    mult = {"k": 1_000, "m": 1_000_000}
+    out = []
+    for tok in text.lower().split(","):
+        tok = tok.strip()
+        out.append(int(float(tok[:-1]) * mult[tok[-1]]) if tok[-1] in mult else int(tok))
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="업로드 파이프라인 벤치마크")
+    ap.add_argument("--layouts", default="woori,kb,generic")
+    ap.add_argument("--formats", default="xlsx,xls,csv")
+    ap.add_argument("--rows", default="1k,100k", help="예: 1k,100k,1m")
+    ap.add_argument("--rules", default="10,500,5000")
+    ap.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "bench_statements"))
+    ap.add_argument("--json", help="결과를 JSON 으로 저장할 경로")
+    args = ap.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    rule_sets = {n: make_rules(n) for n in _parse_sizes(args.rules)}
+    results: List[dict] = []
+
+    formats = args.formats.split(",")
+    if "xls" in formats and importlib.util.find_spec("xlwt") is None:
+        formats.remove("xls")
+        print("⏭️ xls skipped: install xlwt (pip install -r requirements-bench.txt) — xls 리더는 측정되지 않음")
+
+    print(f"{'file':<22} {'stage':<30} {'time':>10} {'throughput':>19} {'peak RSS':>11}")
+    for layout in args.layouts.split(","):
+        for fmt in formats:
+            for n in _parse_sizes(args.rows):
+                if fmt == "xls" and n > XLS_MAX_ROWS:
+                    print(f"  ⏭️ {layout}/xls/{n} 건너뜀 (xls 최대 {XLS_MAX_ROWS:,}행)", file=sys.stderr)
+                    continue
+                path = ensure_file(args.data_dir, layout, fmt, n)
+                bench_file(path, layout, fmt, n, rule_sets, results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 {args.json} 저장 ({len(results)}건)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# api/db.py
+"""
+데이터 접근 계층
+- supabase-py(동기) 쿼리를 이벤트 루프 밖 전용 스레드 풀에서 실행 → 느린 쿼리가 다른 요청을 막지 않음
+- 라우트는 `.execute()` 대신 `await run(쿼리빌더)` 로 호출
+- 호출별 대기/실행 시간 집계 → stats()
+- fetch_frame(): 조건에 맞는 전체 행을 병렬 페이지 조회로 DataFrame 에 바로 적재
+- DATA_BACKEND=fake 면 네트워크 없이 메모리 테이블로 동작 (오프라인 부하 테스트용)
+"""
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any, Callable, Sequence
+
+import pandas as pd
+
+DATA_BACKEND = os.environ.get('DATA_BACKEND', 'supabase')  # supabase | fake
+DB_MAX_WORKERS = int(os.environ.get('DB_MAX_WORKERS', 16))  # 동시에 나가는 DB 호출 상한
+DB_SLOW_MS = int(os.environ.get('DB_SLOW_MS', 1000))  # 이 이상 걸린 호출은 로그
+DB_PAGE_SIZE = int(os.environ.get('DB_PAGE_SIZE', 1000))  # PostgREST max-rows 이하로
+DB_PAGE_CONCURRENCY = int(os.environ.get('DB_PAGE_CONCURRENCY', 6))  # fetch_frame 동시 페이지 수
+FAKE_DB_SEED = os.environ.get('FAKE_DB_SEED')  # {테이블: [행, ...]} JSON 파일
+FAKE_DB_LATENCY_MS = float(os.environ.get('FAKE_DB_LATENCY_MS', 0))  # 가짜 백엔드 왕복 지연 흉내
+
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix='db')
+
+_STATS_WINDOW = 500  # 라벨별 p95 계산용 최근 표본 수
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def create_data_client(url: Optional[str], key: Optional[str]):
+    """DATA_BACKEND 에 맞는 클라이언트 (supabase Client 또는 FakeClient)"""
+    if DATA_BACKEND == 'fake':
+        return FakeClient.shared()
+    from supabase import create_client
+    return create_client(url, key)
+
+
+def query_label(query) -> str:
+    """'GET transactions' 형태의 집계 라벨 (postgrest 빌더의 http_method / path)"""
+    method = getattr(query, 'http_method', None) or '?'
+    path = str(getattr(query, 'path', None) or '?').strip('/')
+    return f"{method} {path}"
+
+
+def _record(label: str, wait_ms: float, exec_ms: float, ok: bool) -> None:
+    with _stats_lock:
+        st = _stats.get(label)
+        if st is None:
+            st = _stats[label] = {
+                'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'wait_ms': 0.0,
+                'recent': deque(maxlen=_STATS_WINDOW),
+            }
+        st['calls'] += 1
+        st['errors'] += 0 if ok else 1
+        st['total_ms'] += exec_ms
+        st['max_ms'] = max(st['max_ms'], exec_ms)
+        st['wait_ms'] += wait_ms
+        st['recent'].append(exec_ms)
+    if exec_ms >= DB_SLOW_MS:
+        print(f"🐢 [db] {label} {exec_ms:.0f}ms (대기 {wait_ms:.0f}ms)")
+
+
+async def call(fn: Callable[..., Any], *args, label: Optional[str] = None) -> Any:
+    """동기 함수를 DB 스레드 풀에서 실행하고 대기(풀 큐)/실행 시간을 집계"""
+    label = label or getattr(fn, '__name__', 'call')
+    submitted = time.perf_counter()
+    timing: Dict[str, float] = {}
+
+    def timed():
+        timing['start'] = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timing['end'] = time.perf_counter()
+
+    ok = False
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_executor, timed)
+        ok = True
+        return result
+    finally:
+        start = timing.get('start', submitted)
+        end = timing.get('end', time.perf_counter())
+        _record(label, (start - submitted) * 1000, (end - start) * 1000, ok)
+
+
+async def run(query, label: Optional[str] = None):
+    """쿼리 빌더의 .execute() 를 스레드 풀에서 실행 (반환값은 .execute() 와 동일)"""
+    return await call(query.execute, label=label or query_label(query))
+
+
+async def fetch_frame(
+    client,
+    table: str,
+    columns: str = '*',
+    where: Callable[[Any], Any] = lambda q: q,
+    order: Sequence[str] = ('id',),
+    page_size: int = DB_PAGE_SIZE,
+    concurrency: int = DB_PAGE_CONCURRENCY,
+) -> pd.DataFrame:
+    """
+    조건에 맞는 전체 행 → DataFrame (range 페이지를 하나씩 순서대로 받던 루프 대체)
+    - 첫 페이지를 count='exact' 로 받아 전체 건수 확인 → 나머지 페이지는 동시성 제한 병렬 조회
+    - order 컬럼 순으로 정렬해 페이지 경계를 고정 (마지막 컬럼은 유일 키여야 함)
+    - where(q): select 이후 빌더에 필터를 걸어 반환하는 함수
+    - 집계 뒤에 행이 늘어 마지막 페이지가 꽉 찼으면 짧은 페이지가 나올 때까지 이어서 조회
+    """
+    def page(start: int, count: Optional[str] = None):
+        q = where(client.table(table).select(columns, count=count))
+        for col in order:
+            q = q.order(col)
+        return q.range(start, start + page_size - 1)
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch(start: int) -> List[dict]:
+        async with sem:
+            return (await run(page(start))).data or []
+
+    first = await run(page(0, 'exact'))
+    pages = [first.data or []]
+    if first.count is not None:
+        pages += await asyncio.gather(*(fetch(s) for s in range(page_size, first.count, page_size)))
+    while len(pages[-1]) == page_size:
+        pages.append(await fetch(len(pages) * page_size))
+
+    names = None if columns.strip() == '*' else [c.strip() for c in columns.split(',')]
+    return pd.DataFrame.from_records(list(chain.from_iterable(pages)), columns=names)
+
+
+def stats() -> Dict[str, Any]:
+    """라벨별 호출 수 / 오류 / 평균·p95·최대 실행 시간 / 평균 풀 대기 시간 (ms)"""
+    with _stats_lock:
+        out = {}
+        for label, st in sorted(_stats.items()):
+            recent = sorted(st['recent'])
+            n = st['calls']
+            out[label] = {
+                'calls': n,
+                'errors': st['errors'],
+                'avg_ms': round(st['total_ms'] / n, 1),
+                'p95_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1),
+                'max_ms': round(st['max_ms'], 1),
+                'avg_wait_ms': round(st['wait_ms'] / n, 1),
+            }
+    return {'backend': DATA_BACKEND, 'max_workers': DB_MAX_WORKERS, 'calls': out}
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+# =========================
+# 가짜 백엔드 (메모리 테이블, postgrest 빌더 중 이 앱이 쓰는 부분만)
+# =========================
+def _like(pattern: str, case: bool) -> re.Pattern:
+    rx = ''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch) for ch in pattern)
+    return re.compile(f"^{rx}$", re.S if case else re.S | re.I)
+
+
+def _compare(a: Any, b: Any, op: Callable[[Any, Any], bool]) -> bool:
+    if a is None or b is None:
+        return False
+    try:
+        return op(a, b)
+    except TypeError:
+        return op(str(a), str(b))
+
+
+class FakeClient:
+    """supabase Client 대역: table(name) → FakeQuery"""
+    _shared: Optional['FakeClient'] = None
+
+    def __init__(self, seed: Optional[Dict[str, List[dict]]] = None):
+        self.tables: Dict[str, List[dict]] = {k: [dict(r) for r in v] for k, v in (seed or {}).items()}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'FakeClient':
+        """프로세스 공용 인스턴스 (FAKE_DB_SEED 가 있으면 그 내용으로 시작)"""
+        if cls._shared is None:
+            seed = None
+            if FAKE_DB_SEED:
+                with open(FAKE_DB_SEED, encoding='utf-8') as f:
+                    seed = json.load(f)
+                print(f"🧪 가짜 DB 시드 로드: {', '.join(f'{k}={len(v)}' for k, v in seed.items())}")
+            cls._shared = cls(seed)
+        return cls._shared
+
+    def table(self, name: str) -> 'FakeQuery':
+        return FakeQuery(self, name)
+
+    from_ = table
+
+
+class FakeQuery:
+    """postgrest 요청 빌더 대역 (select/insert/upsert/update/delete + 필터/정렬/범위)"""
+
+    def __init__(self, client: FakeClient, name: str):
+        self.client = client
+        self.path = f"/{name}"
+        self.name = name
+        self.http_method = 'GET'
+        self.op = 'select'
+        self.columns: Optional[List[str]] = None
+        self.count: Optional[str] = None
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.ignore_duplicates = False
+        self.filters: List[Callable[[dict], bool]] = []
+        self.orders: List[tuple] = []
+        self.offset = 0
+        self.max_rows: Optional[int] = None
+        self.single_mode: Optional[str] = None
+
+    # --- 동작 ---
+    def select(self, columns: str = '*', count: Optional[str] = None) -> 'FakeQuery':
+        cols = [c.strip() for c in columns.split(',') if c.strip()]
+        self.columns = None if '*' in cols else cols
+        self.count = count
+        return self
+
+    def insert(self, rows, **_) -> 'FakeQuery':
+        self.op, self.http_method, self.payload = 'insert', 'POST', rows
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, ignore_duplicates: bool = False, **_) -> 'FakeQuery':
+        self.op, self.http_method, self.payload = 'upsert', 'POST', rows
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, fields: dict, **_) -> 'FakeQuery':
+        self.op, self.http_method, self.payload = 'update', 'PATCH', fields
+        return self
+
+    def delete(self, **_) -> 'FakeQuery':
+        self.op, self.http_method = 'delete', 'DELETE'
+        return self
+
+    # --- 필터 ---
+    def _where(self, col: str, pred: Callable[[Any], bool]) -> 'FakeQuery':
+        self.filters.append(lambda r: pred(r.get(col)))
+        return self
+
+    def eq(self, col, v):
+        return self._where(col, lambda x: x == v or (x is not None and str(x) == str(v)))
+
+    def neq(self, col, v):
+        return self._where(col, lambda x: not (x == v or (x is not None and str(x) == str(v))))
+
+    def gt(self, col, v):
+        return self._where(col, lambda x: _compare(x, v, lambda a, b: a > b))
+
+    def gte(self, col, v):
+        return self._where(col, lambda x: _compare(x, v, lambda a, b: a >= b))
+
+    def lt(self, col, v):
+        return self._where(col, lambda x: _compare(x, v, lambda a, b: a < b))
+
+    def lte(self, col, v):
+        return self._where(col, lambda x: _compare(x, v, lambda a, b: a <= b))
+
+    def in_(self, col, values):
+        allowed = {str(v) for v in values}
+        return self._where(col, lambda x: x is not None and str(x) in allowed)
+
+    def like(self, col, pattern):
+        rx = _like(pattern, True)
+        return self._where(col, lambda x: x is not None and bool(rx.match(str(x))))
+
+    def ilike(self, col, pattern):
+        rx = _like(pattern, False)
+        return self._where(col, lambda x: x is not None and bool(rx.match(str(x))))
+
+    def is_(self, col, v):
+        return self._where(col, lambda x: x is None if v in (None, 'null') else x is v)
+
+    def match(self, query: dict):
+        for col, v in query.items():
+            self.eq(col, v)
+        return self
+
+    # --- 정렬/범위 ---
+    def order(self, col, desc: bool = False, **_):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n: int, **_):
+        self.max_rows = n
+        return self
+
+    def range(self, start: int, end: int, **_):
+        self.offset, self.max_rows = start, end - start + 1
+        return self
+
+    def single(self):
+        self.single_mode = 'single'
+        return self
+
+    def maybe_single(self):
+        self.single_mode = 'maybe'
+        return self
+
+    # --- 실행 ---
+    def _rows(self) -> List[dict]:
+        return self.client.tables.setdefault(self.name, [])
+
+    def _project(self, row: dict) -> dict:
+        return dict(row) if self.columns is None else {c: row.get(c) for c in self.columns}
+
+    def _write(self, rows: List[dict]) -> List[dict]:
+        keys = [k.strip() for k in (self.on_conflict or 'id').split(',')]
+        out = []
+        for r in rows:
+            r = dict(r)
+            if self.op == 'upsert':
+                hit = next((t for t in self._rows() if all(str(t.get(k)) == str(r.get(k)) for k in keys)), None)
+                if hit is not None:
+                    if not self.ignore_duplicates:
+                        hit.update(r)
+                        out.append(dict(hit))
+                    continue
+            r.setdefault('id', str(uuid.uuid4()))
+            r.setdefault('created_at', datetime.now().isoformat())
+            self._rows().append(r)
+            out.append(dict(r))
+        return out
+
+    def execute(self):
+        if FAKE_DB_LATENCY_MS:
+            time.sleep(FAKE_DB_LATENCY_MS / 1000)
+        with self.client.lock:
+            table = self._rows()
+            if self.op in ('insert', 'upsert'):
+                rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                return SimpleNamespace(data=self._write(rows), count=None)
+
+            matched = [r for r in table if all(f(r) for f in self.filters)]
+            if self.op == 'update':
+                for r in matched:
+                    r.update(self.payload)
+                return SimpleNamespace(data=[dict(r) for r in matched], count=None)
+            if self.op == 'delete':
+                ids = {id(r) for r in matched}
+                table[:] = [r for r in table if id(r) not in ids]
+                return SimpleNamespace(data=[dict(r) for r in matched], count=None)
+
+            for col, desc in reversed(self.orders):  # 뒤 키부터 안정 정렬, None 은 항상 뒤
+                present = [r for r in matched if r.get(col) is not None]
+                missing = [r for r in matched if r.get(col) is None]
+                present.sort(key=lambda r: (str(type(r[col])), r[col]), reverse=desc)
+                matched = present + missing
+            total = len(matched)
+            end = None if self.max_rows is None else self.offset + self.max_rows
+            data = [self._project(r) for r in matched[self.offset:end]]
+            count = total if self.count else None
+
+        if self.single_mode == 'single':
+            if len(data) != 1:
+                raise RuntimeError(f"single(): {self.name} 결과 {len(data)}건")
+            return SimpleNamespace(data=data[0], count=count)
+        if self.single_mode == 'maybe':
+            return SimpleNamespace(data=data[0] if data else None, count=count)
+        return SimpleNamespace(data=data, count=count)
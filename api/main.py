@@ -1,7 +1,13 @@
 # api/main.py
-import io
 import os
-from typing import Optional, List, Dict, Any, Literal
+import time
+import uuid
+import hashlib
+import asyncio
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Literal, Callable, BinaryIO
 import httpx
 import numpy as np
 import pandas as pd
@@ -10,8 +16,7 @@ from calendar import monthrange
 from dateutil.relativedelta import relativedelta
 from fastapi import FastAPI, UploadFile, File, Form, Header,APIRouter, HTTPException, Depends, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from supabase import create_client, Client
+from fastapi.responses import Response, StreamingResponse
 from openai import OpenAI
 from dotenv import load_dotenv
 from urllib.parse import quote
@@ -19,12 +24,17 @@ from pydantic import BaseModel, field_validator
 import math
 import re
 import jwt
-import requests
 import json
 
 load_dotenv()
 
-from utils import unify_columns, normalize_vendor, apply_rules, load_spreadsheet
+from utils import (
+    normalize_vendor_series, load_merchant_dictionary,
+    compile_rules,
+    file_content_hash, upload_fingerprint, prepare_statement, render_frame, export_frame, OUTPUT_FORMATS, evict_lru,
+    iter_preview,
+)
+import db
 
 
 # === ENV ===
@@ -34,13 +44,22 @@ SUPABASE_ANON_KEY = os.environ.get('SUPABASE_ANON_KEY')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 ALLOWED_ORIGINS = [o.strip() for o in os.environ.get('ALLOWED_ORIGINS', '*').split(',') if o.strip()]
 DEV_USER_ID = os.environ.get('DEV_USER_ID')
+MERCHANT_DICT_PATH = os.environ.get('MERCHANT_DICT_PATH')
 
-if not all([SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_ANON_KEY]):
+if db.DATA_BACKEND != 'fake' and not all([SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_ANON_KEY]):
     raise RuntimeError('환경변수(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_ANON_KEY)가 필요합니다.')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# ✅ 모든 DB 호출은 db.run(쿼리) 로 → 이벤트 루프 밖 스레드 풀에서 실행
+# service_role 키 클라이언트 1개를 프로세스 전체가 공유 (RLS 우회, admin 조회 포함)
+supabase = db.create_data_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
+if MERCHANT_DICT_PATH:
+    try:
+        print(f"🏪 가맹점 사전 로드 완료: {load_merchant_dictionary(MERCHANT_DICT_PATH)}건")
+    except Exception as e:
+        print("⚠️ 가맹점 사전 로드 실패:", e)
+
 app = FastAPI()
 
 allowed_origins = [
@@ -88,20 +107,272 @@ def build_download_headers(filename: str) -> dict:
         "Content-Disposition": f"attachment; filename=\"{ascii_fallback}\"; filename*=UTF-8''{quote(filename)}"
     }
 
+# === Bulk insert pipeline ===
+INSERT_CHUNK_BYTES = int(os.environ.get('INSERT_CHUNK_BYTES', 512 * 1024))  # 청크당 JSON 페이로드 상한
+INSERT_CHUNK_MAX_ROWS = 1000
+INSERT_CONCURRENCY = int(os.environ.get('INSERT_CONCURRENCY', 4))
+INSERT_RETRIES = 3
+
+
+def _chunk_by_bytes(recs: List[dict], max_bytes: int, max_rows: int) -> List[List[dict]]:
+    """직렬화 크기 기준 청크 분할 (이벤트 루프 밖 스레드에서 실행)"""
+    chunks: List[List[dict]] = []
+    cur: List[dict] = []
+    size = 0
+    for r in recs:
+        n = len(json.dumps(r, ensure_ascii=False, default=str).encode('utf-8')) + 1
+        if cur and (size + n > max_bytes or len(cur) >= max_rows):
+            chunks.append(cur)
+            cur, size = [], 0
+        cur.append(r)
+        size += n
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+async def bulk_insert(
+    table: str,
+    recs: List[dict],
+    on_conflict: Optional[str] = None,
+    chunk_bytes: int = INSERT_CHUNK_BYTES,
+    concurrency: int = INSERT_CONCURRENCY,
+    on_chunk: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    대량 insert: 페이로드 크기로 청크 분할 → DB 스레드 풀 + 동시성 제한 실행 → 실패 청크 재시도.
+    on_conflict 지정 시 upsert(ignore_duplicates) 로 보내므로 재시도해도 중복 행이 생기지 않는다.
+    on_chunk: 청크 저장 성공 시 행 수로 호출 (업로드 작업 진행률 갱신용)
+    반환: rows / chunks / retries / 청크별 latency_ms
+    """
+    if not recs:
+        return {"rows": 0, "chunks": 0, "retries": 0, "latency_ms": []}
+
+    chunks = await asyncio.to_thread(_chunk_by_bytes, recs, chunk_bytes, INSERT_CHUNK_MAX_ROWS)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    latency = [0.0] * len(chunks)
+    retries = 0
+
+    def send(chunk: List[dict]):
+        q = supabase.table(table)
+        if on_conflict:
+            return q.upsert(chunk, on_conflict=on_conflict, ignore_duplicates=True)
+        return q.insert(chunk)
+
+    async def run(i: int, chunk: List[dict]):
+        nonlocal retries
+        async with sem:
+            for attempt in range(1, INSERT_RETRIES + 1):
+                t0 = time.perf_counter()
+                try:
+                    await db.run(send(chunk))
+                    latency[i] = round((time.perf_counter() - t0) * 1000, 1)
+                    if on_chunk:
+                        on_chunk(len(chunk))
+                    return
+                except Exception as e:
+                    if attempt == INSERT_RETRIES:
+                        raise
+                    retries += 1
+                    print(f"⚠️ [{table}] 청크 {i} ({len(chunk)}건) 재시도 {attempt}: {e}")
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+    await asyncio.gather(*(run(i, c) for i, c in enumerate(chunks)))
+    return {"rows": len(recs), "chunks": len(chunks), "retries": retries, "latency_ms": latency}
+
+
+FINGERPRINT_LOOKUP_CHUNK = 200  # in.() 조회 1회당 지문 수 (URL 길이 제한)
+
+
+async def existing_fingerprints(user_id: str, branch: str, fingerprints: List[str]) -> set:
+    """
+    이미 저장된 거래 지문 집합.
+    지문을 청크로 나눠 청크당 in.() 조회 1회 (행 단위 조회 없음), 동시성은 INSERT_CONCURRENCY 로 제한.
+    """
+    sem = asyncio.Semaphore(max(1, INSERT_CONCURRENCY))
+    found: set = set()
+
+    async def run(chunk: List[str]):
+        async with sem:
+            res = await db.run(
+                supabase.table('transactions')
+                .select('fingerprint')
+                .eq('user_id', user_id)
+                .eq('branch', branch)
+                .in_('fingerprint', chunk)
+            )
+        found.update(r['fingerprint'] for r in res.data or [])
+
+    await asyncio.gather(*(
+        run(fingerprints[i:i + FINGERPRINT_LOOKUP_CHUNK])
+        for i in range(0, len(fingerprints), FINGERPRINT_LOOKUP_CHUNK)
+    ))
+    return found
+
+
+def build_tx_records(group: pd.DataFrame, user_id: str, upload_id: Any, branch: str) -> List[dict]:
+    """
+    월별 그룹 → transactions insert 레코드 (컬럼 단위 변환).
+    id 는 (upload_id, 행 순번) 기반 uuid5 로 고정 → 청크 재전송이 멱등이 된다.
+    """
+    def text(col: str, default: str) -> pd.Series:
+        s = group[col] if col in group.columns else pd.Series(None, index=group.index, dtype=object)
+        return s.where(s.notna() & (s.astype(str) != ''), default)
+
+    def num(col: str) -> pd.Series:
+        s = group[col] if col in group.columns else pd.Series(0.0, index=group.index)
+        return pd.to_numeric(s, errors='coerce').fillna(0.0).astype(float)
+
+    vendor = group['vendor_normalized'] if 'vendor_normalized' in group.columns else None
+    out = pd.DataFrame({
+        'id': [str(uuid.uuid5(uuid.NAMESPACE_OID, f"{upload_id}:{i}")) for i in range(len(group))],
+        'user_id': user_id,
+        'upload_id': upload_id,
+        'branch': branch,
+        'tx_date': pd.to_datetime(group['date'], errors='coerce').dt.normalize().dt.strftime('%Y-%m-%dT%H:%M:%S'),  # ✅ 날짜만 유지
+        'description': text('description', ''),
+        'memo': text('memo', ''),
+        'amount': num('amount'),
+        'balance': num('balance'),
+        'category': text('category', '미분류'),
+        'vendor_normalized': vendor.astype(object).where(vendor.notna(), None) if vendor is not None else None,
+        'is_fixed': group['is_fixed'].fillna(False).astype(bool) if 'is_fixed' in group.columns else False,
+    }, index=group.index)
+    if 'fingerprint' in group.columns:
+        out['fingerprint'] = group['fingerprint']
+    return out.to_dict('records')
+
+
 # === Auth ===
-SUPABASE_JWT_PUBLIC_KEY = None
-try:
-    jwks_url = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"
-    jwks = requests.get(jwks_url, timeout=5).json()
-    if jwks.get("keys"):
-        SUPABASE_JWT_PUBLIC_KEY = jwt.algorithms.RSAAlgorithm.from_jwk(jwks["keys"][0])
-        print("🔑 Supabase JWT public key 로드 완료")
-except Exception as e:
-    print("⚠️ Supabase JWT public key 로드 실패:", e)
+ROLES = ('admin', 'viewer', 'user')
+ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL', 300))  # profiles.role 캐시 유지 시간 (초)
+JWT_ROLE_CLAIM = os.environ.get('JWT_ROLE_CLAIM')  # 예: app_metadata.role — 토큰에 있으면 profiles 조회 생략
+
+# user_id → (role, 저장 시각)
+_role_cache: Dict[str, tuple] = {}
+
+
+def _claim_role(payload: Dict[str, Any]) -> Optional[str]:
+    """JWT_ROLE_CLAIM(점 경로) 위치의 역할 값 (admin/viewer/user 가 아니면 None)"""
+    if not JWT_ROLE_CLAIM:
+        return None
+    value: Any = payload
+    for key in JWT_ROLE_CLAIM.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value if value in ROLES else None
+
+
+def invalidate_role(user_id: Optional[str] = None) -> None:
+    """profiles.role 변경 후 호출 (user_id 없으면 전체 비움)"""
+    if user_id:
+        _role_cache.pop(user_id, None)
+    else:
+        _role_cache.clear()
+
+
+JWKS_URL = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 3600))  # 이 시간이 지난 키는 쓰면서 백그라운드 갱신 (초)
+JWKS_MIN_REFRESH = 30  # JWKS 재조회 최소 간격 (모르는 kid 폭주 / 조회 실패 시 보호, 초)
+TOKEN_CACHE_MAX = int(os.environ.get('TOKEN_CACHE_MAX', 10000))
+
+# kid → jwt.PyJWK, 마지막 성공/시도 시각
+_jwks: Dict[str, Any] = {'keys': {}, 'fetched_at': 0.0, 'attempted_at': 0.0}
+_jwks_lock = asyncio.Lock()
+_jwks_task: Optional[asyncio.Task] = None
+# sha256(token) → (user_id, exp, 역할 클레임) — exp 까지 재검증 생략
+_token_cache: Dict[str, tuple] = {}
+_auth_http: Optional[httpx.AsyncClient] = None
+
+
+def auth_http() -> httpx.AsyncClient:
+    """Supabase Auth 호출용 공용 커넥션 풀 (JWKS 조회 + /auth/v1/user fallback)"""
+    global _auth_http
+    if _auth_http is None:
+        _auth_http = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _auth_http
+
+
+async def refresh_jwks() -> None:
+    """JWKS 다시 받기 — 동시 호출은 1회로 합치고, 실패하면 기존 키 유지"""
+    async with _jwks_lock:
+        if time.time() - _jwks['attempted_at'] < JWKS_MIN_REFRESH:
+            return
+        _jwks['attempted_at'] = time.time()
+        try:
+            r = await auth_http().get(JWKS_URL)
+            r.raise_for_status()
+            keys = {}
+            for k in r.json().get('keys', []):
+                try:
+                    keys[k.get('kid')] = jwt.PyJWK(k)
+                except Exception as e:
+                    print(f"⚠️ JWKS 키 건너뜀 (kid={k.get('kid')}): {e}")
+            _jwks['keys'] = keys
+            _jwks['fetched_at'] = time.time()
+            print(f"🔑 Supabase JWKS 로드 완료: {len(keys)}개 키")
+        except Exception as e:
+            print("⚠️ Supabase JWKS 로드 실패:", e)
+
+
+def _schedule_jwks_refresh() -> None:
+    global _jwks_task
+    if _jwks_task is None or _jwks_task.done():
+        _jwks_task = asyncio.create_task(refresh_jwks())
+
+
+async def get_signing_key(kid: Optional[str]) -> Optional[Any]:
+    """
+    토큰 헤더 kid 에 맞는 공개키 (없으면 None → /auth/v1/user fallback)
+    - 모르는 kid(키 회전 직후, 첫 요청) → JWKS 재조회 후 다시 찾음
+    - JWKS_TTL 이 지난 키는 그대로 쓰고 갱신은 백그라운드에서
+    """
+    if _jwks['keys'] and time.time() - _jwks['fetched_at'] > JWKS_TTL:
+        _schedule_jwks_refresh()
+
+    def lookup():
+        keys = _jwks['keys']
+        return keys.get(kid) if kid else next(iter(keys.values()), None)
+
+    key = lookup()
+    if key is None:
+        await refresh_jwks()
+        key = lookup()
+    return key
+
+
+def _remember_token(cache_key: str, user_id: str, payload: Dict[str, Any]) -> None:
+    """검증된 토큰을 exp 까지 캐시 (exp 없으면 캐시하지 않음)"""
+    exp = payload.get('exp')
+    if not isinstance(exp, (int, float)):
+        return
+    if len(_token_cache) >= TOKEN_CACHE_MAX:
+        now = time.time()
+        for k in [k for k, v in _token_cache.items() if v[1] <= now]:
+            del _token_cache[k]
+        while len(_token_cache) >= TOKEN_CACHE_MAX:
+            _token_cache.pop(next(iter(_token_cache)))  # 가장 오래된 항목부터
+    _token_cache[cache_key] = (user_id, float(exp), _claim_role(payload))
+
+
+@app.on_event('startup')
+async def warm_jwks():
+    # 기동을 막지 않도록 백그라운드로 미리 받아 둔다 (import 시점 네트워크 호출 없음)
+    _schedule_jwks_refresh()
+
+
+@app.on_event('shutdown')
+async def close_auth_http():
+    if _auth_http is not None:
+        await _auth_http.aclose()
+
 
 async def get_user_id(authorization: Optional[str]) -> str:
     """
     ✅ Supabase Auth 토큰을 로컬에서 decode (매 요청시 외부 HTTP 호출 없음)
+    - kid 로 JWKS 공개키 선택, 검증된 토큰은 exp 까지 캐시
     """
     if not authorization or not authorization.lower().startswith("bearer "):
         if DEV_USER_ID:
@@ -110,22 +381,46 @@ async def get_user_id(authorization: Optional[str]) -> str:
 
     token = authorization.split(" ", 1)[1]
 
-    # 1️⃣ Public key가 없으면 fallback (예: local dev)
-    if SUPABASE_JWT_PUBLIC_KEY is None:
+    now = time.time()
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    hit = _token_cache.get(cache_key)
+    if hit and hit[1] > now:
+        user_id, _, role = hit
+        if role:
+            _role_cache[user_id] = (role, now)
+        return user_id
+
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    key = await get_signing_key(kid)
+
+    # 1️⃣ 검증 키가 없으면 fallback (예: local dev, JWKS 조회 실패)
+    if key is None:
         url = f"{SUPABASE_URL}/auth/v1/user"
         headers = {"Authorization": f"Bearer {token}", "apikey": SUPABASE_ANON_KEY}
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.get(url, headers=headers)
-            if r.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid token")
-            return r.json()["id"]
+        r = await auth_http().get(url, headers=headers)
+        if r.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        user_id = r.json()["id"]
+        try:
+            # Auth 서버가 검증한 토큰 → exp / 역할 클레임만 읽어 캐시
+            _remember_token(cache_key, user_id, jwt.decode(token, options={"verify_signature": False}))
+        except Exception:
+            pass
+        return user_id
 
     # 2️⃣ 정상 케이스: JWT 로컬 검증
     try:
-        payload = jwt.decode(token, SUPABASE_JWT_PUBLIC_KEY, algorithms=["RS256"])
+        payload = jwt.decode(token, key.key, algorithms=[key.algorithm_name])
         user_id = payload.get("sub")
         if not user_id:
             raise ValueError("user_id(sub) 누락")
+        role = _claim_role(payload)
+        if role:
+            _role_cache[user_id] = (role, now)
+        _remember_token(cache_key, user_id, payload)
         return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -149,20 +444,25 @@ async def get_user_role(authorization: Optional[str]) -> Optional[str]:
 async def get_role(user_id: str) -> str:
     """
     Supabase profiles 테이블에서 role(admin/viewer/user) 조회.
-    service_role 키로 호출해 RLS 우회.
+    공용 service_role 클라이언트로 호출해 RLS 우회.
+    - ROLE_CACHE_TTL 동안 프로세스 내 캐시 (JWT 역할 클레임이 있으면 get_user_id 가 미리 채움)
+    - 조회 오류는 캐시하지 않음
     """
+    hit = _role_cache.get(user_id)
+    if hit and time.time() - hit[1] < ROLE_CACHE_TTL:
+        return hit[0]
+
     try:
-        # ✅ 서비스 키로 다시 클라이언트 생성 (RLS 무시)
-        admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        res = admin.table('profiles').select('role').eq('id', user_id).execute()
+        res = await db.run(supabase.table('profiles').select('role').eq('id', user_id))
 
         if res.data and len(res.data) > 0:
             role = res.data[0].get('role', 'user')
             print(f"✅ [get_role] user_id={user_id}, role={role}")
-            return role
-
-        print(f"⚠️ [get_role] user_id={user_id} 결과 없음")
-        return 'user'
+        else:
+            role = 'user'
+            print(f"⚠️ [get_role] user_id={user_id} 결과 없음")
+        _role_cache[user_id] = (role, time.time())
+        return role
 
     except Exception as e:
         print(f"❌ [get_role 오류]: {e}")
@@ -187,6 +487,13 @@ class AssignPayload(BaseModel):
     save_rule: bool = False
     rule_keyword_source: Literal['vendor','description','memo','any'] = 'any'
 
+class BatchUploadItem(BaseModel):
+    branch: str
+    period_year: int
+    period_month: int
+    start_month: Optional[str] = None
+    end_month: Optional[str] = None
+
 class CategoryCreate(BaseModel):
     l1: str
     l2: Optional[str] = None
@@ -217,6 +524,14 @@ class SalonKPIInput(BaseModel):
 async def health():
     return {"status": "ok"}
 
+@app.get('/health/db')
+async def health_db(authorization: Optional[str] = Header(None)):
+    """DB 호출 라벨별 호출 수 / 지연 (ms) — 부하 테스트/운영 확인용 (admin 전용, 공개 liveness 는 /health)"""
+    user_id = await get_user_id(authorization)
+    if await get_role(user_id) != 'admin':
+        raise HTTPException(status_code=403, detail="admin only")
+    return db.stats()
+
 @app.get('/meta/branches')
 async def meta_branches(authorization: Optional[str] = Header(None)):
     user_id = await get_user_id(authorization)
@@ -225,22 +540,22 @@ async def meta_branches(authorization: Optional[str] = Header(None)):
 
     try:
         if role in ['admin', 'viewer']:
-            res1 = supabase.table('branches').select('name').execute()
+            res1 = await db.run(supabase.table('branches').select('name'))
             for r in res1.data or []:
                 if r.get('name'):
                     names.add(r['name'])
             
-            res2 = supabase.table('transactions').select('branch').neq('branch', '').execute()
+            res2 = await db.run(supabase.table('transactions').select('branch').neq('branch', ''))
             for r in res2.data or []:
                 if r.get('branch'):
                     names.add(r['branch'])
         else:
-            res1 = supabase.table('branches').select('name').eq('user_id', user_id).execute()
+            res1 = await db.run(supabase.table('branches').select('name').eq('user_id', user_id))
             for r in res1.data or []:
                 if r.get('name'):
                     names.add(r['name'])
             
-            res2 = supabase.table('transactions').select('branch').eq('user_id', user_id).neq('branch', '').execute()
+            res2 = await db.run(supabase.table('transactions').select('branch').eq('user_id', user_id).neq('branch', ''))
             for r in res2.data or []:
                 if r.get('branch'):
                     names.add(r['branch'])
@@ -252,6 +567,18 @@ async def meta_branches(authorization: Optional[str] = Header(None)):
     print(f"✅ [meta/branches] user_id={user_id}, role={role}, count={len(names)}, names={list(names)}")
     return sorted(list(names))
 
+@app.post('/admin/role-cache/invalidate')
+async def invalidate_role_cache(
+    user_id: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None)
+):
+    """profiles.role 을 직접 바꾼 뒤 호출 (admin 전용, user_id 없으면 전체)"""
+    caller = await get_user_id(authorization)
+    if await get_role(caller) != 'admin':
+        raise HTTPException(status_code=403, detail="admin only")
+    invalidate_role(user_id)
+    return {"ok": True, "user_id": user_id}
+
 @app.get('/me')
 async def me(authorization: Optional[str] = Header(None)):
     user_id = await get_user_id(authorization)
@@ -261,176 +588,292 @@ async def me(authorization: Optional[str] = Header(None)):
     print(f"🔍 /me 요청 — get_role 반환값: {role}")
     return {"user_id": user_id, "role": role}
 
+# === Rules cache ===
+RULES_CACHE_TTL = int(os.environ.get('RULES_CACHE_TTL', 300))  # 다른 워커/직접 DB 수정 대비 안전망 (초)
+
+# user_id → 규칙 버전 (규칙 쓰기마다 +1) / 캐시 항목 {'version', 'rules', 'compiled', 'loaded_at'}
+_rules_version: Dict[str, int] = {}
+_rules_cache: Dict[str, Dict[str, Any]] = {}
+
+
+async def fetch_active_rules(user_id: str) -> List[dict]:
+    res = await db.run(
+        supabase.table('rules')
+        .select('*')
+        .eq('user_id', user_id)
+        .eq('is_active', True)
+        .order('priority', desc=True)
+    )
+    return res.data or []
+
+
+async def get_rule_set(user_id: str) -> Dict[str, Any]:
+    """
+    사용자 활성 규칙 + 컴파일된 매처 (프로세스 내 캐시)
+    - 규칙 버전이 바뀌었거나 TTL 이 지났을 때만 다시 조회/컴파일
+    - 조회 도중 무효화되면 옛 버전으로 저장되므로 다음 호출에서 다시 읽는다
+    """
+    version = _rules_version.get(user_id, 0)
+    entry = _rules_cache.get(user_id)
+    if entry and entry['version'] == version and time.time() - entry['loaded_at'] < RULES_CACHE_TTL:
+        return entry
+
+    rules = await fetch_active_rules(user_id)
+    entry = {'version': version, 'rules': rules, 'compiled': compile_rules(rules), 'loaded_at': time.time()}
+    _rules_cache[user_id] = entry
+    return entry
+
+
+def invalidate_rules(user_id: str) -> None:
+    """규칙 생성/수정/삭제 후 호출"""
+    _rules_version[user_id] = _rules_version.get(user_id, 0) + 1
+    _rules_cache.pop(user_id, None)
+
+
 # === Upload ===
-@app.post('/upload')
-async def upload_file(
-    file: UploadFile = File(...),
-    branch: str = Form(...),
-    period_year: int = Form(...),
-    period_month: int = Form(...),
-    start_month: Optional[str] = Form(None),
-    end_month: Optional[str] = Form(None),
-    authorization: Optional[str] = Header(None)
-):
+
+
+async def find_imported_upload(user_id: str, file_hash: str) -> List[dict]:
+    """같은 file_hash 로 저장이 끝난(status=processed) uploads 레코드 (없으면 빈 리스트)"""
+    res = await db.run(
+        supabase.table('uploads')
+        .select('id, branch, period_year, period_month, total_rows, original_filename, created_at')
+        .eq('user_id', user_id)
+        .eq('file_hash', file_hash)
+        .eq('status', 'processed')
+        .order('period_year')
+        .order('period_month')
+    )
+    return res.data or []
+
+
+def already_imported_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    uploads = result['uploads']
+    return {
+        'status': 'already_imported',
+        'message': '이미 업로드된 파일입니다. 다시 올리려면 기존 업로드를 삭제하세요.',
+        'file_hash': result['file_hash'],
+        'upload_ids': [u['id'] for u in uploads],
+        'total_rows': sum(int(u.get('total_rows') or 0) for u in uploads),
+        'uploads': uploads,
+    }
+
+
+async def discard_uploads(upload_ids: List[Any]) -> None:
+    """저장 도중 실패한 업로드 정리: 부분 저장된 거래 + uploads 레코드 삭제 → 같은 파일을 다시 올릴 수 있게"""
+    for i in range(0, len(upload_ids), FINGERPRINT_LOOKUP_CHUNK):
+        chunk = upload_ids[i:i + FINGERPRINT_LOOKUP_CHUNK]
+        await db.run(supabase.table('transactions').delete().in_('upload_id', chunk))
+        await db.run(supabase.table('uploads').delete().in_('id', chunk))
+
+
+def processed_filename(branch: str, period_year: int, period_month: int,
+                       start_month: Optional[str], end_month: Optional[str], ext: str = 'xlsx') -> str:
+    # 파일 이름 자동 지정
+    if start_month and end_month:
+        return f"processed_{branch}_{start_month}_{end_month}.{ext}"
+    return f"processed_{branch}_{period_year}-{int(period_month):02d}.{ext}"
+
+
+# === 처리 결과 보관 (file_hash 단위 parquet, 업로드 id 로 나중에 다운로드) ===
+PROCESSED_DIR = os.environ.get('PROCESSED_DIR') or os.path.join(tempfile.gettempdir(), 'processed_uploads')
+PROCESSED_MAX_BYTES = int(os.environ.get('PROCESSED_MAX_BYTES', 2 * 1024 ** 3))
+
+# 파싱 결과 캐시 (원본 내용 해시 단위 parquet → 같은 파일 재처리 시 파싱 생략)
+PARSED_CACHE_DIR = os.environ.get('PARSED_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'parsed_statements')
+PARSED_CACHE_MAX_BYTES = int(os.environ.get('PARSED_CACHE_MAX_BYTES', 1024 ** 3))
+
+
+def _processed_path(file_hash: str) -> str:
+    return os.path.join(PROCESSED_DIR, f"{file_hash}.parquet")
+
+
+def store_processed(file_hash: str, df: pd.DataFrame) -> None:
+    """내부 컬럼을 뺀 결과를 요청마다 고유한 임시 파일에 쓰고 교체 (같은 내용 동시 요청끼리 충돌 없음)"""
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PROCESSED_DIR, prefix=f"{file_hash}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        export_frame(df).to_parquet(tmp, index=False)
+        os.replace(tmp, _processed_path(file_hash))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict_lru(PROCESSED_DIR, PROCESSED_MAX_BYTES)
+
+
+def load_processed(file_hash: Optional[str]) -> Optional[pd.DataFrame]:
+    path = _processed_path(file_hash) if file_hash else None
+    if not path or not os.path.exists(path):
+        return None
+    os.utime(path)  # LRU 갱신
+    return pd.read_parquet(path)
+
+
+async def processed_response(df: pd.DataFrame, fmt: str, filename: str, headers: Optional[dict] = None) -> Response:
+    media_type, _ = OUTPUT_FORMATS[fmt]
+    content = await asyncio.to_thread(lambda: render_frame(export_frame(df), fmt))
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={**build_download_headers(filename), **(headers or {})}
+    )
+
+
+async def process_upload(
+    user_id: str,
+    source: BinaryIO,
+    filename: str,
+    branch: str,
+    period_year: int,
+    period_month: int,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    job: Optional[Dict[str, Any]] = None,
+    rule_set: Optional[Dict[str, Any]] = None,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> Dict[str, Any]:
     """
-    📂 파일 업로드 (단일 + 다중월 자동 분리 완전 지원)
-    - start_month, end_month 지정 시: 해당 범위 내 월별 자동 분리 저장
-    - 지정 안 하면: 기존 단일 월 업로드 그대로
+    업로드 처리 본체 (동기 /upload, 비동기 작업 워커, /upload/batch 가 공유)
+    - 파싱/분류는 스레드로 넘겨 이벤트 루프를 막지 않는다
+    - executor(프로세스 풀) 지정 시 그쪽에서 파싱 → source 는 디스크 파일 객체여야 함 (source.name 경로 사용)
+    - rule_set 을 넘기면 그대로 사용 (배치 업로드에서 사용자당 1회 조회 공유), 없으면 규칙 캐시
+    - job 이 주어지면 phase / rows_parsed / rows_inserted 를 갱신
+    - 같은 파일(내용 + 지점 + 기간)이 이미 저장돼 있으면 파싱/DB 쓰기 없이 기존 uploads 만 반환
+    - 모든 거래가 이미 저장된 달도 total_rows=0 인 uploads 를 남긴다 (다음 재업로드를 file_hash 로 바로 거름)
+    - uploads 는 status=processing 으로 만들고 모든 달의 거래 저장이 끝나야 processed 로 전환,
+      하나라도 실패하면 이번 업로드의 uploads/거래를 지우고 예외 전파 (재시도 시 already_imported 로 막히지 않음)
+    반환: 처리된 df, 저장 건수, 저장 개월 수, file_hash (또는 already_imported)
     """
-    user_id = await get_user_id(authorization)
-    content = await file.read()
+    def set_phase(phase: str):
+        if job is not None:
+            job['phase'] = phase
+            job['updated_at'] = time.time()
 
+    def count_inserted(n: int):
+        if job is not None:
+            job['rows_inserted'] += n
+
+    branch = branch.strip()  # 지문 / 중복 조회 / 저장 컬럼 모두 같은 값 사용
     print(f"📤 업로드 요청: user={user_id}, branch={branch}, start={start_month}, end={end_month}")
 
-    # 0️⃣ 새 지점 자동 등록
+    # 0️⃣ 동일 파일 재업로드 확인 (파싱 전, 내용 해시 + 지점 + 기간)
+    content_hash = await asyncio.to_thread(file_content_hash, source)
+    period = f"{start_month}~{end_month}" if start_month and end_month else f"{period_year}-{int(period_month):02d}"
+    file_hash = upload_fingerprint(content_hash, branch, period)
+    previous = await find_imported_upload(user_id, file_hash)
+    if previous:
+        print(f"♻️ [{branch}] {filename} 이미 업로드됨 → {len(previous)}개월 재사용")
+        return {'already_imported': True, 'file_hash': file_hash, 'uploads': previous}
+
+    # 새 지점 자동 등록
     try:
-        existing = (
+        existing = await db.run(
             supabase.table('branches')
             .select('id')
             .eq('user_id', user_id)
             .eq('name', branch)
             .limit(1)
-            .execute()
         )
         if not existing.data:
-            supabase.table('branches').upsert(
+            await db.run(supabase.table('branches').upsert(
                 {'user_id': user_id, 'name': branch},
                 on_conflict='user_id,name'
-            ).execute()
+            ))
     except Exception as e:
         print(f"⚠️ branches 자동등록 중 오류: {e}")
 
-    # 1️⃣ 엑셀 로드 + 컬럼 정규화
+    # 1️⃣ 파싱 → 정리 → 기간 필터 → 규칙 분류 → 지문 (CPU 작업: 스레드 또는 프로세스 풀)
+    if rule_set is None:
+        rule_set = await get_rule_set(user_id)
+    cache = {'content_hash': content_hash, 'cache_dir': PARSED_CACHE_DIR, 'cache_max_bytes': PARSED_CACHE_MAX_BYTES}
     try:
-        df_raw = load_spreadsheet(content, file.filename)
-        df = unify_columns(df_raw)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"파일 읽기 오류: {e}")
-
-    df = df.replace([np.nan, np.inf, -np.inf], None)
-    if 'memo' not in df.columns:
-        df['memo'] = ''
-    else:
-        df['memo'] = df['memo'].fillna('')
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
-    df = df[df['date'].notna()].copy()
-
-    # 2️⃣ 기간 지정 필터 (선택적)
-    if start_month and end_month:
-        start_date = pd.to_datetime(f"{start_month}-01")
-        end_date = pd.Period(end_month).end_time  # ✅ 수정됨
-        before = len(df)
-        df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-        print(f"🗓️ 기간 필터 적용: {start_month} ~ {end_month} ({before} → {len(df)}건)")
-    else:
-        print("🗓️ 단일 월 업로드로 처리")
-
-    if df.empty:
-        raise HTTPException(status_code=400, detail="선택된 기간에 해당하는 거래내역이 없습니다.")
-
-    # 3️⃣ 규칙 적용
-    df['vendor_normalized'] = df['description'].apply(normalize_vendor)
-    rules = (
-        supabase.table('rules')
-        .select('*')
-        .eq('user_id', user_id)
-        .eq('is_active', True)
-        .order('priority', desc=True)
-        .execute()
-        .data or []
-    )
-    applied = [apply_rules(row.to_dict(), rules) for _, row in df.iterrows()]
-    df = pd.concat([df, pd.DataFrame(applied)], axis=1)
-
-    # ✅ 여기 추가
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')  # ⬅️ 추가
-    df = df[df['date'].notna()].copy()                       # ⬅️ 추가
+        if executor is not None:
+            set_phase('parsing')
+            loop = asyncio.get_running_loop()
+            df, load_meta = await loop.run_in_executor(executor, partial(
+                prepare_statement, source.name, filename, branch, rule_set['rules'], start_month, end_month, **cache,
+            ))
+        else:
+            df, load_meta = await asyncio.to_thread(
+                prepare_statement, source, filename, branch, rule_set['compiled'], start_month, end_month,
+                on_phase=set_phase, **cache,
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if job is not None:
+        job['rows_parsed'] = load_meta['rows_parsed']
 
     # 4️⃣ 월별 자동 분리 (여러 달 업로드 지원)
-    df['year'] = df['date'].dt.year
-    df['month'] = df['date'].dt.month
     month_groups = df.groupby(['year', 'month'])
     multi_upload = bool(start_month and end_month)
+    created_ids: List[Any] = []  # 이번 요청이 만든 uploads id (실패 시 정리 대상)
 
-    total_tx = 0
-    total_uploads = 0
-
-    for (y, m), group in month_groups:
-        # ✅ 단일 업로드 모드일 때는 지정 월만 처리
-        if not multi_upload and (y != period_year or m != period_month):
-            continue
-
+    async def save_month(y: int, m: int, group: pd.DataFrame) -> Dict[str, Any]:
+        month_df = group
         print(f"📦 [{branch}] {y}-{m:02d} 데이터 {len(group)}건 저장 중...")
 
+        # 이미 저장된 거래(겹치는 기간 재업로드) 제외 → 지문 집합 조회로 새 행만 남김
+        seen = await existing_fingerprints(user_id, branch, group['fingerprint'].tolist())
+        if seen:
+            print(f"🔁 [{branch}] {y}-{m:02d} 기존 거래 {len(seen)}건 제외")
+            group = group[~group['fingerprint'].isin(seen)]
+
         # ✅ 여기 수정됨 (upload_data 먼저 정의하고 변환)
         upload_data = {
             'user_id': user_id,
             'branch': branch,
             'period_year': int(y),
             'period_month': int(m),
-            'original_filename': str(file.filename),
+            'original_filename': str(filename),
             'total_rows': int(len(group)),
-            'status': 'processed',
+            'status': 'processing',
+            'file_hash': file_hash,
         }
         if start_month:
             upload_data['start_month'] = start_month
         if end_month:
             upload_data['end_month'] = end_month
 
-        # ✅ numpy.int64, np.float64 등 안전 변환
-        upload_data = {
-            k: (int(v) if isinstance(v, (np.integer,)) else v)
-            for k, v in upload_data.items()
-        }
-
-        up = supabase.table('uploads').insert(upload_data).execute()
+        up = await db.run(supabase.table('uploads').insert(upload_data))
         upload_id = up.data[0]['id']
+        created_ids.append(upload_id)
 
-        # 5️⃣ 거래내역 저장
-        recs = []
-        for _, r in group.iterrows():
-            tx_date = pd.to_datetime(r['date'], errors="coerce").normalize()  # ✅ 날짜만 유지
-            recs.append({
-                'user_id': user_id,
-                'upload_id': upload_id,
-                'branch': branch,
-                'tx_date': tx_date.isoformat(),  # ✅ 시간대 변환 제거
-                'description': (r.get('description') or ''),
-                'memo': (r.get('memo') or ''),
-                'amount': float(r.get('amount', 0) or 0),
-                'balance': float(r.get('balance', 0) or 0),
-                'category': (r.get('category') or '미분류'),
-                'vendor_normalized': r.get('vendor_normalized'),
-                'is_fixed': bool(r.get('is_fixed', False))
-            })
-
-        for i in range(0, len(recs), 500):
-            supabase.table('transactions').insert(recs[i:i + 500]).execute()
-
-        total_tx += len(group)
-        total_uploads += 1
+        # 5️⃣ 거래내역 저장 (청크 병렬 + 재시도) / 자산 자동등록은 동시에 진행
+        recs = await asyncio.to_thread(build_tx_records, group, user_id, upload_id, branch)
+        stats, _ = await asyncio.gather(
+            bulk_insert('transactions', recs, on_conflict='id', on_chunk=count_inserted),
+            save_month_asset(y, m, month_df),
+        )
+        lat = stats['latency_ms'] or [0.0]
+        print(
+            f"✅ [{branch}] {y}-{m:02d} 거래 {stats['rows']}건 / {stats['chunks']}청크 "
+            f"(재시도 {stats['retries']}, 청크 지연 평균 {np.mean(lat):.0f}ms · 최대 {max(lat):.0f}ms)"
+        )
+        return {**stats, 'upload_id': upload_id}
 
+    async def save_month_asset(y: int, m: int, group: pd.DataFrame) -> None:
         # ✅ [자산 자동등록] (월별 마지막 잔액 기준)
         try:
             if 'balance' not in group.columns or group.empty:
                 print(f"⚠️ {y}-{m} balance 없음 → 건너뜀")
-                continue
+                return
 
             last_row = group.sort_values('date').iloc[-1]
             last_balance = float(last_row['balance'] or 0)
             memo_pattern = f"{y}년 {m}월 말 잔액 기준 자동등록"
 
-            supabase.table('assets_log') \
-                .delete() \
-                .eq('user_id', user_id) \
-                .eq('branch', branch) \
-                .ilike('memo', f'%{memo_pattern}%') \
-                .execute()
-
             next_y, next_m = (y + 1, 1) if m == 12 else (y, m + 1)
             created_at = datetime(next_y, next_m, 1, 0, 0, 0)
 
-            supabase.table('assets_log').insert({
+            await db.run(
+                supabase.table('assets_log')
+                .delete()
+                .eq('user_id', user_id)
+                .eq('branch', branch)
+                .ilike('memo', f'%{memo_pattern}%')
+            )
+            await db.run(supabase.table('assets_log').insert({
                 'user_id': user_id,
                 'branch': branch,
                 'type': '수입',
@@ -439,32 +882,506 @@ async def upload_file(
                 'amount': last_balance,
                 'memo': memo_pattern,
                 'created_at': created_at.isoformat()
-            }).execute()
-
+            }))
             print(f"✅ [{branch}] {y}-{m:02d} 자산 자동등록 완료 → {last_balance:,.0f}원")
         except Exception as e:
             print(f"⚠️ 자산 자동등록 오류 ({y}-{m}): {e}")
 
+    # ✅ 단일 업로드 모드일 때는 지정 월만 처리
+    targets = [
+        (int(y), int(m), group)
+        for (y, m), group in month_groups
+        if multi_upload or (y == period_year and m == period_month)
+    ]
+    month_sem = asyncio.Semaphore(INSERT_CONCURRENCY)
+    set_phase('saving')
+
+    async def save_month_bounded(y: int, m: int, group: pd.DataFrame) -> Dict[str, Any]:
+        async with month_sem:
+            return await save_month(y, m, group)
+
+    results = await asyncio.gather(*(save_month_bounded(y, m, g) for y, m, g in targets), return_exceptions=True)
+    failed = next((r for r in results if isinstance(r, BaseException)), None)
+    if failed is None and created_ids:
+        try:
+            await db.run(supabase.table('uploads').update({'status': 'processed'}).in_('id', created_ids))
+        except Exception as e:
+            failed = e
+    if failed is not None:
+        print(f"❌ [{branch}] {filename} 저장 실패 → 업로드 {len(created_ids)}건 정리: {failed}")
+        try:
+            await discard_uploads(created_ids)
+        except Exception as e:
+            print(f"⚠️ 실패한 업로드 정리 중 오류 (processing 상태로 남음, file_hash={file_hash}): {e}")
+        raise failed
+    month_stats = results
+    total_tx = sum(st['rows'] for st in month_stats)
+    total_uploads = sum(1 for st in month_stats if st['upload_id'])
+
     print(f"🎯 총 {total_uploads}개월 / {total_tx}건 거래 저장 완료")
 
-    # 6️⃣ 엑셀 결과 반환
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='transactions')
-    out.seek(0)
+    # 처리 결과 보관 → 응답에 바로 싣지 않아도 나중에 업로드 id 로 받을 수 있음
+    await asyncio.to_thread(store_processed, file_hash, df)
 
-    # 파일 이름 자동 지정
-    if start_month and end_month:
-        filename = f"processed_{branch}_{start_month}_{end_month}.xlsx"
-    else:
-        filename = f"processed_{branch}_{period_year}-{period_month:02d}.xlsx"
+    return {
+        'df': df,
+        'upload_ids': [st['upload_id'] for st in month_stats if st['upload_id']],
+        'total_tx': total_tx,
+        'total_uploads': total_uploads,
+        'file_hash': file_hash,
+        'rows_parsed': load_meta['rows_parsed'],
+        'layout': load_meta.get('layout'),
+    }
 
-    headers = build_download_headers(filename)
-    return Response(
-        content=out.read(),
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers=headers
+
+# === Upload jobs (비동기 업로드) ===
+UPLOAD_JOB_WORKERS = int(os.environ.get('UPLOAD_JOB_WORKERS', 2))
+UPLOAD_JOB_DIR = os.environ.get('UPLOAD_JOB_DIR') or os.path.join(tempfile.gettempdir(), 'upload_jobs')
+UPLOAD_JOB_TTL = 6 * 3600  # 완료/실패 작업 보관 시간 (초)
+UPLOAD_JOB_SYNC_SECS = 2  # 진행 상황을 upload_jobs 테이블에 반영하는 주기 (초)
+UPLOAD_JOB_HEARTBEAT = 30  # 변화가 없어도 이 간격으로 updated_at 갱신 (초)
+UPLOAD_JOB_STALE = 120  # 이 시간 동안 갱신 없는 진행 중 작업 = 처리하던 프로세스가 사라짐 (초)
+
+# job_id → 상태 dict: 이 프로세스에서 실행 중인 작업의 실시간 상태
+# upload_jobs 테이블에도 주기적으로 반영 → 다른 워커 프로세스/재시작 후에도 조회 가능
+UPLOAD_JOBS: Dict[str, Dict[str, Any]] = {}
+_UPLOAD_JOB_FIELDS = (
+    'id', 'user_id', 'filename', 'branch', 'phase', 'rows_parsed', 'rows_inserted', 'upload_ids',
+    'file_hash', 'result_url', 'already_imported', 'error', 'created_at', 'updated_at',
+)
+_upload_job_sem = asyncio.Semaphore(UPLOAD_JOB_WORKERS)
+_upload_job_tasks: set = set()
+
+
+def _prune_upload_jobs():
+    """TTL 지난 완료/실패 작업과 파일 정리"""
+    now = time.time()
+    for job_id, job in list(UPLOAD_JOBS.items()):
+        if job['phase'] in ('done', 'error') and now - job['updated_at'] > UPLOAD_JOB_TTL:
+            path = job.get('_source_path')
+            if path and os.path.exists(path):
+                os.remove(path)
+            UPLOAD_JOBS.pop(job_id, None)
+
+
+def _public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if not k.startswith('_')}
+
+
+async def _persist_job(job: Dict[str, Any]) -> None:
+    """upload_jobs 테이블에 현재 상태 기록 (실패해도 작업은 계속 진행)"""
+    row = {k: job.get(k) for k in _UPLOAD_JOB_FIELDS}
+    row['download_args'] = list(job['_download_args'])
+    try:
+        await db.run(supabase.table('upload_jobs').upsert(row, on_conflict='id'))
+    except Exception as e:
+        print(f"⚠️ upload_jobs 저장 실패 ({job['id']}): {e}")
+
+
+async def _sync_job(job: Dict[str, Any], stop: asyncio.Event) -> None:
+    """
+    작업이 끝날 때까지 단계/건수 변화(또는 하트비트 주기)마다 테이블 갱신, stop 후 최종 상태 1회 기록.
+    쓰기는 이 태스크 하나가 순서대로 하므로 늦게 끝난 중간 상태가 최종 상태를 덮지 않는다.
+    """
+    last, last_at = None, 0.0
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), UPLOAD_JOB_SYNC_SECS)
+        except asyncio.TimeoutError:
+            pass
+        snap = (job['phase'], job['rows_parsed'], job['rows_inserted'])
+        if stop.is_set() or snap != last or time.time() - last_at >= UPLOAD_JOB_HEARTBEAT:
+            job['updated_at'] = time.time()
+            await _persist_job(job)
+            last, last_at = snap, time.time()
+
+
+async def _run_upload_job(job: Dict[str, Any], params: Dict[str, Any]):
+    """워커 풀(세마포어 UPLOAD_JOB_WORKERS, 프로세스당)에서 저장된 원본 파일을 처리"""
+    stop = asyncio.Event()
+    syncer = asyncio.create_task(_sync_job(job, stop))
+    try:
+        async with _upload_job_sem:
+            try:
+                with open(job['_source_path'], 'rb') as fh:
+                    result = await process_upload(source=fh, job=job, **params)
+                job['file_hash'] = result['file_hash']
+                if result.get('already_imported'):
+                    job.update({'phase': 'done', 'already_imported': already_imported_response(result)})
+                else:
+                    job.update({'upload_ids': result['upload_ids'], 'total_uploads': result['total_uploads']})
+                job.update({'result_url': f"/upload/jobs/{job['id']}/file", 'phase': 'done'})
+                print(f"✅ 업로드 작업 완료: {job['id']} ({job['rows_inserted']}건)")
+            except HTTPException as e:
+                job.update({'phase': 'error', 'error': e.detail})
+            except Exception as e:
+                print(f"❌ 업로드 작업 오류 ({job['id']}): {e}")
+                job.update({'phase': 'error', 'error': str(e)})
+            finally:
+                job['updated_at'] = time.time()
+                src = job.pop('_source_path', None)
+                if src and os.path.exists(src):
+                    os.remove(src)
+    finally:
+        stop.set()
+        await syncer
+
+
+async def enqueue_upload_job(file: UploadFile, user_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """원본을 디스크에 저장하고 작업을 큐에 넣은 뒤 즉시 반환 (queued 상태를 테이블에 먼저 기록)"""
+    _prune_upload_jobs()
+    try:
+        await db.run(
+            supabase.table('upload_jobs').delete()
+            .in_('phase', ['done', 'error'])
+            .lt('updated_at', time.time() - UPLOAD_JOB_TTL)
+        )
+    except Exception as e:
+        print(f"⚠️ upload_jobs 정리 실패: {e}")
+    os.makedirs(UPLOAD_JOB_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    source_path = os.path.join(UPLOAD_JOB_DIR, f"{job_id}.src")
+
+    def store():
+        file.file.seek(0)
+        with open(source_path, 'wb') as out:
+            while chunk := file.file.read(1024 * 1024):
+                out.write(chunk)
+
+    await asyncio.to_thread(store)
+    now = time.time()
+    job = {
+        'id': job_id,
+        'user_id': user_id,
+        'filename': params['filename'],
+        'branch': params['branch'],
+        'phase': 'queued',
+        'rows_parsed': 0,
+        'rows_inserted': 0,
+        'upload_ids': [],
+        'file_hash': None,
+        'result_url': None,
+        'already_imported': None,
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+        '_source_path': source_path,
+        '_download_args': (
+            params['branch'], params['period_year'], params['period_month'],
+            params['start_month'], params['end_month'],
+        ),
+    }
+    UPLOAD_JOBS[job_id] = job
+    await _persist_job(job)
+    task = asyncio.create_task(_run_upload_job(job, {**params, 'user_id': user_id}))
+    _upload_job_tasks.add(task)
+    task.add_done_callback(_upload_job_tasks.discard)
+    return job
+
+
+async def _load_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """다른 프로세스가 처리 중이거나 이미 끝난 작업을 upload_jobs 테이블에서 조회"""
+    try:
+        res = await db.run(supabase.table('upload_jobs').select('*').eq('id', job_id).limit(1))
+    except Exception as e:
+        print(f"⚠️ upload_jobs 조회 실패 ({job_id}): {e}")
+        raise HTTPException(status_code=503, detail="업로드 작업 상태를 조회하지 못했습니다. 잠시 후 다시 시도하세요.")
+    if not res.data:
+        return None
+    row = dict(res.data[0])
+    job = {**row, '_download_args': tuple(row.pop('download_args', None) or ())}
+    job.pop('download_args', None)
+    if job['phase'] not in ('done', 'error') and time.time() - float(job.get('updated_at') or 0) > UPLOAD_JOB_STALE:
+        # 하트비트가 끊김 → 처리하던 프로세스가 재시작/종료됨 (원본 파일도 그 프로세스와 함께 사라짐)
+        job.update({'phase': 'error', 'error': '작업을 처리하던 서버가 재시작되어 중단되었습니다. 파일을 다시 업로드하세요.'})
+    return job
+
+
+async def _get_owned_job(job_id: str, user_id: str) -> Dict[str, Any]:
+    job = UPLOAD_JOBS.get(job_id) or await _load_job(job_id)
+    if not job or job['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail="업로드 작업을 찾을 수 없습니다. (잘못된 job id 이거나 보관 기간이 지남)")
+    return job
+
+
+@app.post('/upload')
+async def upload_file(
+    file: UploadFile = File(...),
+    branch: str = Form(...),
+    period_year: int = Form(...),
+    period_month: int = Form(...),
+    start_month: Optional[str] = Form(None),
+    end_month: Optional[str] = Form(None),
+    async_mode: bool = Query(False, alias='async'),
+    output: Literal['none', 'csv', 'xlsx', 'parquet'] = Query('xlsx'),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    📂 파일 업로드 (단일 + 다중월 자동 분리 완전 지원)
+    - start_month, end_month 지정 시: 해당 범위 내 월별 자동 분리 저장
+    - 지정 안 하면: 기존 단일 월 업로드 그대로
+    - 이미 가져온 파일이면 보관된 처리 결과(없으면 status=already_imported JSON) 반환 (DB 변경 없음)
+    - output: xlsx(기본) | csv | parquet | none(JSON 요약만, 결과 파일은 GET /uploads/{id}/processed)
+    - ?async=1: 파일만 저장하고 job id 즉시 반환 → GET /upload/jobs/{id} 로 진행 상황 조회
+    """
+    user_id = await get_user_id(authorization)
+    params = {
+        'filename': file.filename,
+        'branch': branch,
+        'period_year': period_year,
+        'period_month': period_month,
+        'start_month': start_month,
+        'end_month': end_month,
+    }
+
+    if async_mode:
+        job = await enqueue_upload_job(file, user_id, params)
+        return {'job_id': job['id'], 'status_url': f"/upload/jobs/{job['id']}", 'phase': job['phase']}
+
+    await file.seek(0)
+    result = await process_upload(user_id=user_id, source=file.file, **params)
+    filename = processed_filename(branch, period_year, period_month, start_month, end_month, ext=output)
+
+    if result.get('already_imported'):
+        previous = await asyncio.to_thread(load_processed, result['file_hash']) if output != 'none' else None
+        if previous is None:
+            return already_imported_response(result)
+        return await processed_response(previous, output, filename, {'X-Already-Imported': 'true'})
+
+    if output == 'none':
+        upload_ids = result['upload_ids']
+        return {
+            'status': 'processed',
+            'file_hash': result['file_hash'],
+            'upload_ids': upload_ids,
+            'rows_parsed': result['rows_parsed'],
+            'rows_inserted': result['total_tx'],
+            'months': result['total_uploads'],
+            'processed_url': f"/uploads/{upload_ids[0]}/processed" if upload_ids else None,
+        }
+
+    # 6️⃣ 처리 결과 파일 반환
+    return await processed_response(result['df'], output, filename)
+
+
+@app.get('/upload/jobs/{job_id}')
+async def get_upload_job(job_id: str, authorization: Optional[str] = Header(None)):
+    """
+    비동기 업로드 작업 상태: phase(queued/parsing/classifying/saving/done/error), 파싱/저장 건수
+    - 처리 중인 프로세스면 메모리의 실시간 상태, 아니면 upload_jobs 테이블 (최대 UPLOAD_JOB_SYNC_SECS 지연)
+      → uvicorn 워커가 여러 개여도, 재시작 뒤에도 조회 가능
+    - 처리하던 프로세스가 사라진 작업은 phase=error 로 보고 (하트비트 UPLOAD_JOB_STALE 초 초과)
+    """
+    user_id = await get_user_id(authorization)
+    return _public_job(await _get_owned_job(job_id, user_id))
+
+
+@app.get('/upload/jobs/{job_id}/file')
+async def download_upload_job_file(
+    job_id: str,
+    format: Literal['csv', 'xlsx', 'parquet'] = Query('xlsx'),
+    authorization: Optional[str] = Header(None)
+):
+    """완료된 비동기 업로드 작업의 처리 결과 파일"""
+    user_id = await get_user_id(authorization)
+    job = await _get_owned_job(job_id, user_id)
+    if job['phase'] != 'done':
+        raise HTTPException(status_code=409, detail=f"아직 결과 파일이 없습니다. (phase={job['phase']})")
+    df = await asyncio.to_thread(load_processed, job['file_hash'])
+    if df is None:
+        raise HTTPException(status_code=404, detail="처리 결과가 보관 기간이 지나 삭제되었습니다.")
+    return await processed_response(df, format, processed_filename(*job['_download_args'], ext=format))
+
+
+@app.get('/uploads/{upload_id}/processed')
+async def download_processed_upload(
+    upload_id: str,
+    format: Literal['csv', 'xlsx', 'parquet'] = Query('xlsx'),
+    authorization: Optional[str] = Header(None)
+):
+    """업로드 id 로 처리 결과 파일 다시 받기 (업로드 당시 파일 전체)"""
+    user_id = await get_user_id(authorization)
+    res = await db.run(
+        supabase.table('uploads')
+        .select('id, file_hash, branch, period_year, period_month, start_month, end_month')
+        .eq('id', upload_id)
+        .eq('user_id', user_id)
+        .limit(1)
     )
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    up = res.data[0]
+    df = await asyncio.to_thread(load_processed, up.get('file_hash'))
+    if df is None:
+        raise HTTPException(status_code=404, detail="처리 결과가 보관 기간이 지나 삭제되었습니다.")
+    filename = processed_filename(
+        up['branch'], up['period_year'], up['period_month'], up.get('start_month'), up.get('end_month'), ext=format,
+    )
+    return await processed_response(df, format, filename)
+
+
+# === Upload preview (드라이런) ===
+PREVIEW_MAX_ROWS = 1000
+
+
+@app.post('/upload/preview')
+async def upload_preview(
+    file: UploadFile = File(...),
+    limit: int = Query(100, ge=1, le=PREVIEW_MAX_ROWS),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    🔍 업로드 미리보기 — 감지/정규화/분류 결과 앞 limit 행을 NDJSON 으로 스트리밍 (DB 쓰기 없음)
+    1행: {"kind": "meta", format, layout}
+    이후: {"kind": "row", date, description, amount, balance, category, ...}
+    마지막: {"kind": "summary", rows, unparsable_money}
+    limit 행을 채우면 파일의 나머지 부분은 파싱하지 않는다.
+    """
+    user_id = await get_user_id(authorization)
+    compiled = (await get_rule_set(user_id))['compiled']
+
+    # 응답 스트리밍 중에는 UploadFile 이 이미 닫히므로 사본을 잡아 둔다
+    buf = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+    def copy():
+        file.file.seek(0)
+        while chunk := file.file.read(1024 * 1024):
+            buf.write(chunk)
+        buf.seek(0)
+
+    await asyncio.to_thread(copy)
+    meta: Dict[str, Any] = {}
+    batches = iter_preview(buf, file.filename, compiled, limit, meta)
+    try:
+        first = await asyncio.to_thread(next, batches, None)  # 감지 실패는 스트리밍 전에 400 으로
+    except ValueError as e:
+        buf.close()
+        raise HTTPException(status_code=400, detail=f"파일 읽기 오류: {e}")
+
+    def to_lines(batch: pd.DataFrame) -> str:
+        batch = batch.drop(columns=['year', 'month'], errors='ignore')
+        batch.insert(0, 'kind', 'row')
+        return batch.to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+
+    def ndjson():
+        rows = 0
+        try:
+            yield json.dumps({'kind': 'meta', 'format': meta.get('format'), 'layout': meta.get('layout')}, ensure_ascii=False) + '\n'
+            batch = first
+            while batch is not None:
+                rows += len(batch)
+                yield to_lines(batch)
+                batch = next(batches, None)
+            yield json.dumps({
+                'kind': 'summary',
+                'rows': rows,
+                'limit': limit,
+                'unparsable_money': meta.get('unparsable_money', 0),
+            }, ensure_ascii=False) + '\n'
+        finally:
+            batches.close()
+            buf.close()
+
+    print(f"🔍 [preview] user={user_id}, {file.filename} → 포맷={meta.get('format')}, 레이아웃={meta.get('layout')}")
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
+# === Batch upload (다중 파일) ===
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """파싱/분류 전용 프로세스 풀 (첫 배치 업로드 때 생성)"""
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _parse_pool
+
+
+@app.on_event('shutdown')
+def shutdown_parse_pool():
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@app.post('/upload/batch')
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    manifest: str = Form(...),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    📂 다중 파일 일괄 업로드 (월말 지점/계좌별 10~30개)
+    - manifest: files 와 같은 순서의 JSON 배열 [{branch, period_year, period_month, start_month?, end_month?}, ...]
+    - 규칙은 사용자당 1회 조회, 파싱/분류는 프로세스 풀에서 병렬 실행
+    - 파일별 결과 목록 반환 (한 파일 실패가 나머지를 막지 않음)
+    """
+    user_id = await get_user_id(authorization)
+
+    try:
+        items = [BatchUploadItem(**m) for m in json.loads(manifest)]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"manifest 형식 오류: {e}")
+    if len(items) != len(files):
+        raise HTTPException(status_code=400, detail=f"manifest 항목 수({len(items)})와 파일 수({len(files)})가 다릅니다.")
+
+    print(f"📤 일괄 업로드 요청: user={user_id}, {len(files)}개 파일")
+    rule_set = await get_rule_set(user_id)
+    pool = get_parse_pool()
+    sem = asyncio.Semaphore(PARSE_WORKERS)
+
+    async def run(file: UploadFile, item: BatchUploadItem) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {'filename': file.filename, 'branch': item.branch}
+        # 프로세스 풀은 경로로 읽으므로 디스크 임시 파일로 옮겨 둔다
+        tmp = tempfile.NamedTemporaryFile(prefix='batch_', suffix='.src', delete=False)
+        try:
+            async with sem:
+                def store():
+                    file.file.seek(0)
+                    while chunk := file.file.read(1024 * 1024):
+                        tmp.write(chunk)
+                    tmp.flush()
+                    tmp.seek(0)
+
+                await asyncio.to_thread(store)
+                result = await process_upload(
+                    user_id=user_id,
+                    source=tmp,
+                    filename=file.filename,
+                    rule_set=rule_set,
+                    executor=pool,
+                    **item.model_dump(),
+                )
+            if result.get('already_imported'):
+                entry.update(already_imported_response(result))
+            else:
+                entry.update({
+                    'status': 'processed',
+                    'layout': result['layout'],
+                    'rows_parsed': result['rows_parsed'],
+                    'rows_inserted': result['total_tx'],
+                    'months': result['total_uploads'],
+                    'upload_ids': result['upload_ids'],
+                    'file_hash': result['file_hash'],
+                })
+        except HTTPException as e:
+            entry.update({'status': 'error', 'error': e.detail})
+        except Exception as e:
+            print(f"❌ 일괄 업로드 오류 ({file.filename}): {e}")
+            entry.update({'status': 'error', 'error': str(e)})
+        finally:
+            tmp.close()
+            os.remove(tmp.name)
+        return entry
+
+    results = await asyncio.gather(*(run(f, it) for f, it in zip(files, items)))
+    summary = {
+        status: sum(1 for r in results if r['status'] == status)
+        for status in ('processed', 'already_imported', 'error')
+    }
+    print(f"🎯 일괄 업로드 완료: {summary}")
+    return {'summary': summary, 'files': results}
 
 
 @app.get("/designer_salaries")
@@ -476,7 +1393,7 @@ async def list_designer_salaries(
 ):
     user_id = await get_user_id(authorization)
     try:
-        data = (
+        res = await db.run(
             supabase.table("designer_salaries")
             .select("name, rank, month, base_amount, extra_amount, total_amount, amount")
             .eq("user_id", user_id)
@@ -485,10 +1402,8 @@ async def list_designer_salaries(
             .lte("month", end_month)
             .order("month", desc=False)
             .order("name", desc=False)
-            .execute()
-            .data
         )
-        return data or []
+        return res.data or []
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"조회 실패: {e}")
 
@@ -756,18 +1671,19 @@ async def salary_manual_save(
         # 1) 먼저 같은 키 조합을 한 번에 지워 중복 방지
         #    (Supabase의 delete IN 절은 or_.in_ 형태 없이 loop로 처리)
         for row in cleaned:
-            supabase.table("designer_salaries") \
-                .delete() \
-                .eq("user_id", user_id) \
-                .eq("branch", row["branch"]) \
-                .eq("name", row["name"]) \
-                .eq("month", row["month"]) \
-                .execute()
+            await db.run(
+                supabase.table("designer_salaries")
+                .delete()
+                .eq("user_id", user_id)
+                .eq("branch", row["branch"])
+                .eq("name", row["name"])
+                .eq("month", row["month"])
+            )
 
         # 2) 벌크 인서트 (500개씩 청크)
         for i in range(0, len(cleaned), 500):
             chunk = cleaned[i:i+500]
-            res = supabase.table("designer_salaries").insert(chunk).execute()
+            res = await db.run(supabase.table("designer_salaries").insert(chunk))
             inserted += len(res.data or [])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"급여 저장 중 오류: {e}")
@@ -787,14 +1703,13 @@ async def salary_manual_delete(payload: dict, authorization: Optional[str] = Hea
         raise HTTPException(status_code=400, detail="필수 필드 누락")
 
     try:
-        res = (
+        res = await db.run(
             supabase.table("designer_salaries")
             .delete()
             .eq("user_id", user_id)
             .eq("branch", branch)
             .eq("name", name)
             .eq("month", month)
-            .execute()
         )
 
         print("🧹 [Supabase 삭제 결과]", res)
@@ -831,7 +1746,7 @@ async def list_designer_salaries(
             .order("month", desc=False)
             .order("name", desc=False)
         )
-        data = q.execute().data or []
+        data = (await db.run(q)).data or []
         return data
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"조회 실패: {e}")
@@ -857,17 +1772,18 @@ async def list_uploads(
     if month:
         q = q.eq('period_month', month)
     q = q.order('created_at', desc=True).range(offset, offset + limit - 1)
-    uploads = q.execute().data or []
+    uploads = (await db.run(q)).data or []
 
     # 2️⃣ 각 업로드별 실시간 미분류 개수 계산
     for u in uploads:
         try:
-            tx_data = supabase.table('transactions') \
-                .select('id', count='exact') \
-                .eq('upload_id', u['id']) \
-                .eq('user_id', user_id) \
-                .eq('category', '미분류') \
-                .execute()
+            tx_data = await db.run(
+                supabase.table('transactions')
+                .select('id', count='exact')
+                .eq('upload_id', u['id'])
+                .eq('user_id', user_id)
+                .eq('category', '미분류')
+            )
             u['unclassified_rows'] = tx_data.count or 0
         except Exception as e:
             print(f"⚠️ 미분류 건수 계산 중 오류 (upload_id={u['id']}):", e)
@@ -895,12 +1811,11 @@ async def mark_fixed(data: dict, authorization: Optional[str] = Header(None)):
             raise HTTPException(status_code=400, detail="transaction_id required")
 
         # ✅ Supabase 업데이트 (본인 데이터만 수정 가능)
-        res = (
+        res = await db.run(
             supabase.table("transactions")
             .update({"is_fixed": is_fixed})
             .eq("id", tx_id)
             .eq("user_id", user_id)
-            .execute()
         )
 
         if not res.data:
@@ -918,23 +1833,26 @@ async def mark_fixed(data: dict, authorization: Optional[str] = Header(None)):
 @app.delete("/uploads/{upload_id}")
 async def delete_upload(upload_id: str):
     # 업로드 존재 확인
-    upload = supabase.table("uploads").select("id").eq("id", upload_id).execute()
+    upload = await db.run(supabase.table("uploads").select("id").eq("id", upload_id))
     if not upload.data:
         raise HTTPException(status_code=404, detail="Upload not found")
 
     # 해당 업로드에 연결된 거래 삭제
-    supabase.table("transactions").delete().eq("upload_id", upload_id).execute()
+    await db.run(supabase.table("transactions").delete().eq("upload_id", upload_id))
 
     # 업로드 메타데이터 삭제
-    supabase.table("uploads").delete().eq("id", upload_id).execute()
+    await db.run(supabase.table("uploads").delete().eq("id", upload_id))
 
     return {"message": "Upload deleted successfully", "id": upload_id}
 @app.get('/meta/category-suggestions')
 async def category_suggestions(authorization: Optional[str] = Header(None)):
     user_id = await get_user_id(authorization)
-    rows = supabase.table('transactions')\
-        .select('category')\
-        .eq('user_id', user_id).neq('category','미분류').execute().data or []
+    res = await db.run(
+        supabase.table('transactions')
+        .select('category')
+        .eq('user_id', user_id).neq('category', '미분류')
+    )
+    rows = res.data or []
     freq = {}
     for r in rows:
         c = (r.get('category') or '').strip()
@@ -946,9 +1864,8 @@ async def category_suggestions(authorization: Optional[str] = Header(None)):
 @app.get('/rules')
 async def list_rules(authorization: Optional[str] = Header(None)):
     user_id = await get_user_id(authorization)
-    res = supabase.table('rules').select('id,keyword,target,category,is_fixed,priority')\
-        .eq('user_id', user_id).eq('is_active', True).order('priority', desc=True).execute()
-    return res.data or []
+    fields = ('id', 'keyword', 'target', 'category', 'is_fixed', 'priority')
+    return [{k: r.get(k) for k in fields} for r in (await get_rule_set(user_id))['rules']]
 class RuleCreate(BaseModel):
     keyword: str
     target: Literal['vendor','description','memo','any'] = 'any'
@@ -962,7 +1879,7 @@ async def create_rule(payload: RuleCreate, authorization: Optional[str] = Header
     kw = (payload.keyword or '').strip()
     if not kw:
         raise HTTPException(status_code=400, detail='keyword required')
-    supabase.table('rules').insert({
+    await db.run(supabase.table('rules').insert({
         'user_id': user_id,
         'keyword': kw,
         'target': payload.target,
@@ -970,78 +1887,197 @@ async def create_rule(payload: RuleCreate, authorization: Optional[str] = Header
         'is_active': True,
         'is_fixed': payload.is_fixed,
         'priority': payload.priority,
-    }).execute()
+    }))
+    invalidate_rules(user_id)
     return {'ok': True}
 
 
-# === 거래 목록 조회 (미분류 + 분류 완료 포함) ===
-@app.get("/transactions/manage")
-async def list_transactions(
-    branch: Optional[str] = None,
-    year: Optional[int] = None,
-    month: Optional[int] = None,
-    authorization: Optional[str] = Header(None)
-):
+class RuleUpdate(BaseModel):
+    keyword: Optional[str] = None
+    target: Optional[Literal['vendor','description','memo','any']] = None
+    category: Optional[str] = None
+    is_fixed: Optional[bool] = None
+    priority: Optional[int] = None
+    is_active: Optional[bool] = None
+
+@app.patch('/rules/{rule_id}')
+async def update_rule(rule_id: str, payload: RuleUpdate, authorization: Optional[str] = Header(None)):
     user_id = await get_user_id(authorization)
-    role = await get_role(user_id)
+    fields = payload.model_dump(exclude_none=True)
+    if 'keyword' in fields:
+        fields['keyword'] = fields['keyword'].strip()
+        if not fields['keyword']:
+            raise HTTPException(status_code=400, detail='keyword required')
+    if not fields:
+        return {'ok': True}
+    res = await db.run(supabase.table('rules').update(fields).eq('user_id', user_id).eq('id', rule_id))
+    invalidate_rules(user_id)
+    if not res.data:
+        raise HTTPException(status_code=404, detail='Rule not found')
+    return {'ok': True}
+
+@app.delete('/rules/{rule_id}')
+async def delete_rule(rule_id: str, authorization: Optional[str] = Header(None)):
+    user_id = await get_user_id(authorization)
+    await db.run(supabase.table('rules').delete().eq('user_id', user_id).eq('id', rule_id))
+    invalidate_rules(user_id)
+    return {'ok': True, 'id': rule_id}
 
-    # ✅ admin/viewer는 모든 유저 데이터 접근 가능 (service-role 우회)
-    if role in ["admin", "viewer"]:
-        db_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        q = db_client.table("transactions").select(
-            "id, user_id, branch, tx_date, description, amount, category, memo, is_fixed"
-        )
-    else:
-        db_client = supabase
-        q = db_client.table("transactions").select(
-            "id, user_id, branch, tx_date, description, amount, category, memo, is_fixed"
-        ).eq("user_id", user_id)
 
-    # ✅ branch 필터
-    if branch and branch.strip():
-        q = q.ilike("branch", f"%{branch.strip()}%")
+class RuleReapply(BaseModel):
+    branch: Optional[str] = None
+    start_month: Optional[str] = None  # 'YYYY-MM'
+    end_month: Optional[str] = None    # 'YYYY-MM'
+    dry_run: bool = False
 
-    # ✅ 날짜 필터
-    if year and month:
-        start_month = f"{year}-{month:02d}-01"
-        end_month = (pd.Timestamp(start_month) + pd.offsets.MonthEnd(1)).strftime("%Y-%m-%d")
+REAPPLY_PAGE_SIZE = 1000
+REAPPLY_UPDATE_CHUNK = 200  # in.() 업데이트 1회당 id 수 (URL 길이 제한)
 
-        q = q.gte("tx_date", start_month).lte("tx_date", end_month)
-    elif year:
-        q = q.gte("tx_date", f"{year}-01-01").lt("tx_date", f"{year + 1}-01-01")
 
-    # ✅ 전체 데이터 페이징 가져오기 (1000건씩)
-    all_data = []
-    start = 0
-    step = 1000
+@app.post('/rules/reapply')
+async def reapply_rules(payload: RuleReapply, authorization: Optional[str] = Header(None)):
+    """
+    🔁 현재 규칙을 기존 거래내역에 다시 적용 (지점/기간 범위)
+    - id 기준 keyset 페이지 순회 → 페이지마다 컴파일된 규칙으로 일괄 분류
+    - 규칙에 매칭되고 category / is_fixed 가 실제로 바뀌는 행만 골라
+      (category, is_fixed) 값 묶음별 in.() 일괄 업데이트 → 수동 분류한 미매칭 행은 그대로 둔다
+    - dry_run: 변경 건수만 계산하고 쓰지 않음
+    """
+    user_id = await get_user_id(authorization)
+    compiled = (await get_rule_set(user_id))['compiled']
+    n_rules = len(compiled.rules)
+    if not n_rules:
+        return {'ok': True, 'dry_run': payload.dry_run, 'scanned': 0, 'changed': 0, 'by_category': {}}
 
+    async def fetch_page(after_id: Optional[str]) -> List[dict]:
+        q = (
+            supabase.table('transactions')
+            .select('id, description, memo, vendor_normalized, category, is_fixed')
+            .eq('user_id', user_id)
+        )
+        if payload.branch:
+            q = q.eq('branch', payload.branch)
+        if payload.start_month:
+            q = q.gte('tx_date', f"{payload.start_month}-01")
+        if payload.end_month:
+            q = q.lt('tx_date', (pd.Period(payload.end_month) + 1).start_time.strftime('%Y-%m-%d'))
+        if after_id:
+            q = q.gt('id', after_id)
+        return (await db.run(q.order('id').limit(REAPPLY_PAGE_SIZE))).data or []
+
+    def diff_page(rows: List[dict]) -> pd.DataFrame:
+        page = pd.DataFrame(rows)
+        missing = page['vendor_normalized'].isna()
+        if missing.any():
+            page.loc[missing, 'vendor_normalized'] = normalize_vendor_series(page.loc[missing, 'description'])
+        idx = compiled.match(page)
+        applied = compiled.classify(page, idx)
+        changed = (idx < n_rules) & (
+            (page['category'].fillna('미분류').to_numpy() != applied['category'].to_numpy())
+            | (page['is_fixed'].fillna(False).astype(bool).to_numpy() != applied['is_fixed'].to_numpy())
+        )
+        return pd.DataFrame({
+            'id': page['id'][changed],
+            'category': applied['category'][changed],
+            'is_fixed': applied['is_fixed'][changed],
+        })
+
+    sem = asyncio.Semaphore(INSERT_CONCURRENCY)
+
+    async def write_group(category: str, is_fixed: bool, ids: List[str]):
+        for i in range(0, len(ids), REAPPLY_UPDATE_CHUNK):
+            async with sem:
+                await db.run(
+                    supabase.table('transactions')
+                    .update({'category': category, 'is_fixed': bool(is_fixed)})
+                    .eq('user_id', user_id)
+                    .in_('id', ids[i:i + REAPPLY_UPDATE_CHUNK])
+                )
+
+    scanned = changed = 0
+    by_category: Dict[str, int] = {}
+    last_id: Optional[str] = None
     while True:
-        res = q.range(start, start + step - 1).execute()
-        if not res.data:
+        rows = await fetch_page(last_id)
+        if not rows:
             break
-        all_data.extend(res.data)
-        if len(res.data) < step:
+        last_id = rows[-1]['id']
+        scanned += len(rows)
+
+        diffs = await asyncio.to_thread(diff_page, rows)
+        if not diffs.empty:
+            changed += len(diffs)
+            for cat, n in diffs['category'].value_counts().items():
+                by_category[cat] = by_category.get(cat, 0) + int(n)
+            if not payload.dry_run:
+                await asyncio.gather(*(
+                    write_group(cat, fixed, g['id'].tolist())
+                    for (cat, fixed), g in diffs.groupby(['category', 'is_fixed'])
+                ))
+        if len(rows) < REAPPLY_PAGE_SIZE:
             break
-        start += step
 
-    data = all_data
-    print(f"📦 전체 거래 수집 완료: {len(data)}건")
+    print(f"🔁 [reapply] user={user_id}, branch={payload.branch}, 검사 {scanned}건 → 변경 {changed}건 {by_category}")
+    return {
+        'ok': True,
+        'dry_run': payload.dry_run,
+        'scanned': scanned,
+        'changed': changed,
+        'by_category': by_category,
+    }
 
-    # ✅ 후처리: 문자열 → datetime 변환 (UTC→KST)
-    for row in data:
-        if row.get("tx_date"):
-            try:
-                row["tx_date"] = (
-                    pd.to_datetime(row["tx_date"], utc=True)
-                    .tz_convert("Asia/Seoul")
-                    .strftime("%Y-%m-%d %H:%M:%S")
-                )
-            except Exception:
-                pass
-        row["memo"] = row.get("memo") or ""
-        row["category"] = row.get("category") or "미분류"
-        row["branch"] = row.get("branch") or ""
-        row["is_fixed"] = bool(row.get("is_fixed", False))
+
+# === 거래 목록 조회 (미분류 + 분류 완료 포함) ===
+@app.get("/transactions/manage")
+async def list_transactions(
+    branch: Optional[str] = None,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    authorization: Optional[str] = Header(None)
+):
+    user_id = await get_user_id(authorization)
+    role = await get_role(user_id)
+
+    def where(q):
+        # ✅ admin/viewer는 모든 유저 데이터 접근 가능 (공용 service-role 클라이언트)
+        if role not in ["admin", "viewer"]:
+            q = q.eq("user_id", user_id)
+
+        # ✅ branch 필터
+        if branch and branch.strip():
+            q = q.ilike("branch", f"%{branch.strip()}%")
+
+        # ✅ 날짜 필터
+        if year and month:
+            start_month = f"{year}-{month:02d}-01"
+            end_month = (pd.Timestamp(start_month) + pd.offsets.MonthEnd(1)).strftime("%Y-%m-%d")
+
+            q = q.gte("tx_date", start_month).lte("tx_date", end_month)
+        elif year:
+            q = q.gte("tx_date", f"{year}-01-01").lt("tx_date", f"{year + 1}-01-01")
+        return q
+
+    # ✅ 전체 데이터 병렬 페이징 → DataFrame
+    df = await db.fetch_frame(
+        supabase, "transactions",
+        "id, user_id, branch, tx_date, description, amount, category, memo, is_fixed",
+        where=where, order=("tx_date", "id"),
+    )
+    print(f"📦 전체 거래 수집 완료: {len(df)}건")
+
+    # ✅ 후처리: 문자열 → datetime 변환 (UTC→KST), 변환 실패 값은 원래 문자열 유지
+    kst = (
+        pd.to_datetime(df["tx_date"], utc=True, errors="coerce", format="ISO8601")
+        .dt.tz_convert("Asia/Seoul")
+        .dt.strftime("%Y-%m-%d %H:%M:%S")
+    )
+    df["tx_date"] = kst.astype(object).where(kst.notna(), df["tx_date"])
+    df = df.astype(object).where(df.notna(), None)
+    df["memo"] = df["memo"].where(df["memo"].astype(bool), "")
+    df["category"] = df["category"].where(df["category"].astype(bool), "미분류")
+    df["branch"] = df["branch"].where(df["branch"].astype(bool), "")
+    df["is_fixed"] = df["is_fixed"].map(bool)
+    data = df.to_dict("records")
 
     return {
         "items": data,
@@ -1115,7 +2151,7 @@ async def get_assets_log(
     query = supabase.table("assets_log").select("*").eq("user_id", user_id)
     if branch:
         query = query.eq("branch", branch)
-    res = query.order("created_at", desc=True).execute()
+    res = await db.run(query.order("created_at", desc=True))
 
     return {"items": res.data}
 
@@ -1128,7 +2164,7 @@ async def add_asset_log(
     """자산 로그 추가 (부동자산 수동 등록 포함)"""
     user_id = await get_user_id(authorization)
 
-    supabase.table("assets_log").insert({
+    await db.run(supabase.table("assets_log").insert({
         "user_id": user_id,
         "type": payload.get("type"),
         "direction": payload.get("direction"),
@@ -1136,7 +2172,7 @@ async def add_asset_log(
         "amount": payload.get("amount"),
         "memo": payload.get("memo", ""),
         "branch": payload.get("branch", None)  # ✅ 지점명 저장
-    }).execute()
+    }))
 
     return {"ok": True}
 
@@ -1149,7 +2185,7 @@ async def delete_asset_log(
 ):
     """자산 로그 삭제"""
     user_id = await get_user_id(authorization)
-    supabase.table("assets_log").delete().eq("id", id).eq("user_id", user_id).execute()
+    await db.run(supabase.table("assets_log").delete().eq("id", id).eq("user_id", user_id))
     return {"ok": True}
 
 # ✅ 자동 급여 불러오기 API (수정판)
@@ -1169,7 +2205,7 @@ async def salary_auto_load(
 
     try:
         # ✅ 1. Supabase 쿼리 (월급만 필터)
-        res = (
+        res = await db.run(
             supabase.table("transactions")
             .select("category, amount, tx_date, description")
             .eq("user_id", user_id)
@@ -1177,7 +2213,6 @@ async def salary_auto_load(
             .gte("tx_date", f"{start}-01")
             .lte("tx_date", pd.Period(end).end_time.strftime("%Y-%m-%d"))
             .ilike("category", "%월급%")
-            .execute()
         )
 
         rows = res.data or []
@@ -1240,7 +2275,7 @@ async def get_liquid_assets(
     if branch:
         query = query.eq("branch", branch)
 
-    res = query.order("created_at", desc=True).execute()
+    res = await db.run(query.order("created_at", desc=True))
     return {"items": res.data}
 
 # === 규칙/카테고리 ===
@@ -1271,23 +2306,22 @@ async def assign_categories(
         update_fields["is_fixed"] = payload.is_fixed
 
     for tid in payload.transaction_ids:
-        supabase.table("transactions") \
-            .update(update_fields) \
-            .eq("user_id", user_id) \
-            .eq("id", tid) \
-            .execute()
+        await db.run(
+            supabase.table("transactions")
+            .update(update_fields)
+            .eq("user_id", user_id)
+            .eq("id", tid)
+        )
         
     # === 룰 저장 ===
     if payload.save_rule:
-        sample = (
+        sample = (await db.run(
             supabase.table("transactions")
             .select("description,memo,vendor_normalized")
             .eq("user_id", user_id)
             .eq("id", payload.transaction_ids[0])
             .single()
-            .execute()
-            .data
-        )
+        )).data
 
         kw = (sample.get("vendor_normalized") or sample.get("description") or sample.get("memo") or "").strip()
 
@@ -1304,7 +2338,8 @@ async def assign_categories(
 
             # ✅ None 값은 제거하고 삽입 (Supabase에서 에러 방지)
             clean_rule_data = {k: v for k, v in rule_data.items() if v is not None}
-            supabase.table("rules").insert(clean_rule_data).execute()
+            await db.run(supabase.table("rules").insert(clean_rule_data))
+            invalidate_rules(user_id)
 
     print(f"✅ [assign] update_fields={update_fields}")
     return {"ok": True, "updated": len(payload.transaction_ids)}
@@ -1321,57 +2356,81 @@ class ReportRequest(BaseModel):
     end_month: Optional[int] = None
 
 
-@app.post("/reports")
-async def get_reports(req: ReportRequest, authorization: Optional[str] = Header(None)):
-    user_id = await get_user_id(authorization)
-    role = await get_role(user_id)
+REPORT_COLUMNS = "tx_date, branch, description, amount, category, memo, is_fixed"
 
-    # === Use admin/service-role client for admin/viewer to bypass RLS ===
-    # Note: service role key must never be exposed to clients.
-    if role in ["admin", "viewer"]:
-        db_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-    else:
-        db_client = supabase
 
-    # === [0] Build base query (will run on db_client which may be admin or regular) ===
-    query = db_client.table("transactions").select("*")
+def report_date_bounds(req: ReportRequest) -> List[tuple]:
+    """
+    /reports 의 연·월·일 필터를 tx_date 조건 [(연산자, 값), ...] 으로 변환.
+    pandas 필터와 같은 범위만 좁힌다 (결과 동일, 전송량만 줄임). 해석이 애매한 값은 조건에서 빼고 pandas 에 맡김.
+    """
+    bounds: List[tuple] = []
+    if req.start_month or req.end_month or req.month:
+        start_m = int(req.start_month or req.month or 1)
+        end_m = int(req.end_month or req.month or start_m)
+        if 1 <= start_m <= 12 and 1 <= end_m <= 12:
+            end = datetime(req.year + 1, 1, 1) if end_m == 12 else datetime(req.year, end_m + 1, 1)
+            bounds += [("gte", f"{req.year}-{start_m:02d}-01"), ("lt", end.strftime("%Y-%m-%d"))]
+    if not bounds:
+        bounds += [("gte", f"{req.year}-01-01"), ("lt", f"{req.year + 1}-01-01")]
 
-    # === Access rules: admin/viewer see all (no user_id filter); normal users restricted ===
-    if role in ["admin", "viewer"]:
-        if req.branch and req.branch.strip():
-            query = query.ilike("branch", f"%{req.branch.strip()}%")
-    else:
-        query = query.eq("user_id", user_id)
-        if req.branch and req.branch.strip():
-            query = query.ilike("branch", f"%{req.branch.strip()}%")
+    if req.granularity == "day" and req.start_date and req.end_date:
+        try:
+            start = pd.to_datetime(req.start_date)
+            end = pd.to_datetime(req.end_date)
+        except (ValueError, TypeError):
+            return bounds
+        if start.tzinfo is None and end.tzinfo is None:
+            bounds += [
+                ("gte", start.strftime("%Y-%m-%dT%H:%M:%S")),
+                ("lte", end.strftime("%Y-%m-%dT%H:%M:%S")),
+            ]
+    return bounds
 
-    # ✅ 여기에 페이징 전체 가져오기 로직 넣기
-    all_data = []
-    start = 0
-    step = 1000
 
-    while True:
-        res = query.range(start, start + step - 1).execute()
-        if not res.data:
-            break
-        all_data.extend(res.data)
-        if len(res.data) < step:
-            break
-        start += step
+@app.post("/reports")
+async def get_reports(req: ReportRequest, authorization: Optional[str] = Header(None)):
+    user_id = await get_user_id(authorization)
+    role = await get_role(user_id)
 
-    data = all_data  # 👈 전체 데이터를 df로 넘김
-    df = pd.DataFrame(data)
+    # === [0] Base query filters (shared service-role client; access rules applied here) ===
+    # Note: service role key must never be exposed to clients.
+    date_bounds = report_date_bounds(req)
 
+    def access(query):
+        # === Access rules: admin/viewer see all (no user_id filter); normal users restricted ===
+        if role in ["admin", "viewer"]:
+            if req.branch and req.branch.strip():
+                query = query.ilike("branch", f"%{req.branch.strip()}%")
+        else:
+            query = query.eq("user_id", user_id)
+            if req.branch and req.branch.strip():
+                query = query.ilike("branch", f"%{req.branch.strip()}%")
+        return query
+
+    def where(query):
+        # === 기간 조건은 DB 에서 (아래 pandas 필터와 같은 범위, tx_date 인덱스 사용) ===
+        query = access(query)
+        for op, value in date_bounds:
+            query = getattr(query, op)("tx_date", value)
+        return query
+
+    # ✅ 리포트에 쓰는 컬럼만 병렬 페이징 → DataFrame 으로 바로 적재
+    df = await db.fetch_frame(supabase, "transactions", REPORT_COLUMNS, where=where, order=("tx_date", "id"))
+
+    # 기간 안에만 거래가 없으면 빈 집계로 계속 진행 — '데이터 없음' 응답은 거래가 아예 없을 때만 (기존 응답 형태 유지)
     if df.empty:
-        print("⚠️ 리포트: 데이터 없음")
-        return {
-            "summary": {},
-            "by_category": {},
-            "by_fixed": [],
-            "by_period": [],
-            "income_details": [],
-            "expense_details": []
-        }
+        exists = await db.run(access(supabase.table("transactions").select("id")).limit(1))
+        if not exists.data:
+            print("⚠️ 리포트: 데이터 없음")
+            return {
+                "summary": {},
+                "by_category": {},
+                "by_fixed": [],
+                "by_period": [],
+                "income_details": [],
+                "expense_details": []
+            }
 
     # === Date conversion and cleaning ===
     df["tx_date"] = pd.to_datetime(df["tx_date"], errors="coerce")
@@ -1538,13 +2597,12 @@ async def get_analyses_meta(
 
     try:
         # ✅ Supabase 요청
-        res = (
+        res = await db.run(
             supabase.table("analyses_meta")
             .select("*")
             .eq("user_id", user_id)
             .eq("branch", branch)
             .maybe_single()
-            .execute()
         )
 
         # ✅ 안전 처리: None 방지
@@ -1594,10 +2652,9 @@ async def save_analyses_meta(
         "updated_at": datetime.now(timezone.utc)
     }
 
-    res = (
+    res = await db.run(
         supabase.table("analyses_meta")
         .upsert(data, on_conflict="user_id,branch")
-        .execute()
     )
 
     if res.error:
@@ -1622,14 +2679,13 @@ async def transaction_summary(
         raise HTTPException(status_code=400, detail="branch, start_month, end_month 필수")
 
     try:
-        res = (
+        res = await db.run(
             supabase.table("transactions")
             .select("tx_date, category, amount, is_fixed")
             .eq("user_id", user_id)
             .eq("branch", branch)
             .gte("tx_date", f"{start}-01")
             .lte("tx_date", pd.Period(end).end_time.strftime("%Y-%m-%d"))
-            .execute()
         )
         rows = res.data or []
         if not rows:
@@ -1668,12 +2724,11 @@ async def get_designers(
     """
     user_id = await get_user_id(authorization)
 
-    res = (
+    res = await db.run(
         supabase.table("designer_meta")
         .select("name, rank")
         .eq("user_id", user_id)
         .eq("branch", branch)
-        .execute()
     )
 
     designers = [{"name": r["name"], "rank": r["rank"]} for r in res.data]
@@ -1700,7 +2755,7 @@ async def save_designers(
         raise HTTPException(status_code=400, detail="branch is required")
 
     # 기존 데이터 삭제
-    supabase.table("designer_meta").delete().eq("user_id", user_id).eq("branch", branch).execute()
+    await db.run(supabase.table("designer_meta").delete().eq("user_id", user_id).eq("branch", branch))
 
     # 새 데이터 삽입
     if designers:
@@ -1713,7 +2768,7 @@ async def save_designers(
             }
             for d in designers
         ]
-        supabase.table("designer_meta").insert(rows).execute()
+        await db.run(supabase.table("designer_meta").insert(rows))
 
     return {"ok": True, "count": len(designers)}
 
@@ -1894,7 +2949,7 @@ async def get_monthly_data(
         raise HTTPException(status_code=400, detail="branch, start_month, end_month 필수")
 
     try:
-        res = (
+        res = await db.run(
             supabase.table("salon_monthly_data")
             .select("*")
             .eq("user_id", user_id)
@@ -1902,7 +2957,6 @@ async def get_monthly_data(
             .gte("month", start_month)
             .lte("month", end_month)
             .order("month", desc=False)
-            .execute()
         )
         data = sorted(res.data or [], key=lambda x: x["month"])
 
@@ -1932,7 +2986,7 @@ async def get_input_sales(
         raise HTTPException(status_code=400, detail="branch, start_month, end_month 필수")
 
     try:
-        res = (
+        res = await db.run(
             supabase.table("salon_input_sales")
             .select("month, card_sales, pay_sales")
             .eq("user_id", user_id)
@@ -1940,7 +2994,6 @@ async def get_input_sales(
             .gte("month", start_month)
             .lte("month", end_month)
             .order("month", desc=False)
-            .execute()
         )
         data = res.data or []
 
@@ -1971,7 +3024,7 @@ async def get_latest_balance(body: dict = Body(...), authorization: Optional[str
 
     try:
         # ✅ 컬럼명: tx_date 사용 (당신의 DB 구조에 맞춤)
-        res = (
+        res = await db.run(
             supabase.table("transactions")
             .select("balance, tx_date")
             .eq("user_id", user_id)
@@ -1979,7 +3032,6 @@ async def get_latest_balance(body: dict = Body(...), authorization: Optional[str
             .lte("tx_date", end_date)
             .order("tx_date", desc=True)
             .limit(1)
-            .execute()
         )
 
         if res.data and len(res.data) > 0:
@@ -2029,7 +3081,7 @@ async def financial_diagnosis(
         return f"{ym}-{last:02d}"
 
     # ===== 1) 월별 기본(매출/고객/정액권/근무일수) =====
-    mres = (
+    mres = await db.run(
         supabase.table("salon_monthly_data")
         .select("month, card_sales, pay_sales, cash_sales, account_sales, visitors, returning_visitors, pass_paid, pass_used, pass_balance")
         .eq("user_id", user_id)
@@ -2037,7 +3089,6 @@ async def financial_diagnosis(
         .gte("month", start_month)
         .lte("month", end_month)
         .order("month", desc=False)
-        .execute()
     )
     mrows = mres.data or []
     if not mrows:
@@ -2054,14 +3105,13 @@ async def financial_diagnosis(
     date_from = f"{start_month}-01"
     date_to = month_last_day(end_month)
 
-    tres = (
+    tres = await db.run(
         supabase.table("transactions")
         .select("tx_date, category, amount, is_fixed")
         .eq("user_id", user_id)
         .eq("branch", branch)
         .gte("tx_date", date_from)
         .lte("tx_date", date_to)
-        .execute()
     )
     tx = tres.data or []
     tx_df = pd.DataFrame(tx) if tx else pd.DataFrame(columns=["tx_date","category","amount","is_fixed"])
@@ -2095,14 +3145,13 @@ async def financial_diagnosis(
         return float(sub["amount"].abs().sum())
 
     # ===== 3) 인건비(디자이너 급여) =====
-    sres = (
+    sres = await db.run(
         supabase.table("designer_salaries")
         .select("month, total_amount")
         .eq("user_id", user_id)
         .eq("branch", branch)
         .gte("month", start_month)
         .lte("month", end_month)
-        .execute()
     )
     sal = sres.data or []
     sdf = pd.DataFrame(sal) if sal else pd.DataFrame(columns=["month","total_amount"])
@@ -2121,10 +3170,10 @@ async def financial_diagnosis(
     # ===== 4) 자산(현금·예금 / 부동자산) =====
     # - 자동등록된 ‘월말 잔액’ 로그가 있으면 그걸 스냅샷으로 사용
     # - 없으면 transactions 최신 balance로 대체하는 함수 재사용
-    def latest_bank_balance(end_ym: str) -> Optional[float]:
+    async def latest_bank_balance(end_ym: str) -> Optional[float]:
         try:
             # assets_log에서 "잔액 기준 자동등록" 최신 1건
-            a = (
+            a = (await db.run(
                 supabase.table("assets_log")
                 .select("amount, created_at, memo, category")
                 .eq("user_id", user_id)
@@ -2133,15 +3182,14 @@ async def financial_diagnosis(
                 .lte("created_at", month_last_day(end_ym))
                 .order("created_at", desc=True)
                 .limit(1)
-                .execute()
-            ).data or []
+            )).data or []
             if a:
                 return float(a[0].get("amount") or 0.0)
         except Exception as e:
             print("⚠️ assets_log 잔액 조회 실패:", e)
         # fallback: transactions 최신 balance
         try:
-            res = (
+            res = (await db.run(
                 supabase.table("transactions")
                 .select("balance, tx_date")
                 .eq("user_id", user_id)
@@ -2149,18 +3197,17 @@ async def financial_diagnosis(
                 .lte("tx_date", month_last_day(end_ym))
                 .order("tx_date", desc=True)
                 .limit(1)
-                .execute()
-            ).data or []
+            )).data or []
             if res:
                 return float(res[0].get("balance") or 0.0)
         except Exception as e:
             print("⚠️ transactions 최신 balance 조회 실패:", e)
         return None
 
-    def latest_fixed_deposit(end_ym: str) -> Optional[float]:
+    async def latest_fixed_deposit(end_ym: str) -> Optional[float]:
         # 보증금(부동자산) 최근 금액(사용자가 자산 로그로 기록했다고 가정)
         try:
-            res = (
+            res = (await db.run(
                 supabase.table("assets_log")
                 .select("amount, created_at, category, memo")
                 .eq("user_id", user_id)
@@ -2169,8 +3216,7 @@ async def financial_diagnosis(
                 .lte("created_at", month_last_day(end_ym))
                 .order("created_at", desc=True)
                 .limit(1)
-                .execute()
-            ).data or []
+            )).data or []
             if res:
                 return float(res[0].get("amount") or 0.0)
         except Exception as e:
@@ -2238,8 +3284,8 @@ async def financial_diagnosis(
         net_margin_est = pct(net_profit_est, monthly_sales)
         # 현금/자산/부채 스냅샷(기간의 마지막 달 기준에서만 의미있음)
         # 월별 결과에도 같이 넣어두고, 최종 요약은 end_month로 산출
-        cash_hold = latest_bank_balance(ym)
-        fixed_deposit = latest_fixed_deposit(ym)
+        cash_hold = await latest_bank_balance(ym)
+        fixed_deposit = await latest_fixed_deposit(ym)
         total_assets = None
         if cash_hold is not None and fixed_deposit is not None:
             total_assets = cash_hold + fixed_deposit
@@ -2505,7 +3551,7 @@ async def financial_diagnosis(
             "created_at": datetime.utcnow().isoformat(),  # ✅ isoformat으로 변경
         }
 
-        res = supabase.table("analyses").insert(record).execute()
+        res = await db.run(supabase.table("analyses").insert(record))
         print("🧾 [analyses insert 결과] =", res)
     except Exception as e:
         import traceback
@@ -2550,14 +3596,13 @@ async def income_filtered(
         end_date = f"{end_month}-{last_day:02d}"
 
         # ✅ Supabase 조회
-        res = (
+        res = await db.run(
             supabase.table("transactions")
             .select("amount, category, tx_date")
             .eq("user_id", user_id)
             .eq("branch", branch)
             .gte("tx_date", f"{start_month}-01")
             .lte("tx_date", end_date)
-            .execute()
         )
 
         rows = res.data or []
@@ -2611,7 +3656,7 @@ async def list_analyses(authorization: Optional[str] = Header(None)):
         #     지금은 역할 무관 전체 접근 허용
         #     (필요 시 admin만 전체 조회로 변경 가능)
 
-        res = q.execute()
+        res = await db.run(q)
         items = res.data or []
 
         # 🔹 viewer도 볼 수 있게 필터링 제거 완료
@@ -2634,12 +3679,11 @@ async def get_analysis_detail(
 
     try:
         # ✅ user_id 필터 제거 — 누구든 전체 분석 열람 가능
-        res = (
+        res = await db.run(
             supabase.table("analyses")
             .select("*")
             .eq("id", analysis_id)
             .maybe_single()
-            .execute()
         )
 
         if not res.data:
@@ -2668,11 +3712,10 @@ async def delete_analysis(
         raise HTTPException(status_code=403, detail="삭제 권한이 없습니다. (admin만 가능)")
 
     try:
-        res = (
+        res = await db.run(
             supabase.table("analyses")
             .delete()
             .eq("id", analysis_id)  # ✅ user_id 조건 제거 (모두 접근 가능)
-            .execute()
         )
 
         # Supabase의 delete는 항상 data=[] 반환하므로 검증 보완
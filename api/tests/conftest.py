@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# main 을 네트워크 없이 import (메모리 테이블 백엔드)
+os.environ.setdefault("DATA_BACKEND", "fake")
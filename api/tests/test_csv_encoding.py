@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from utils import _CSV_SAMPLE_BYTES, iter_spreadsheet, load_unified
+
+
+def _rows(n: int) -> bytes:
+    return "".join(f"2024-01-{i % 28 + 1:02d} 10:00,GS25 store {i},1000,0,{i}\n" for i in range(n)).encode()
+
+
+LATE_CP949 = "2024-02-01 10:00,쿠팡,5000,0,1\n".encode("cp949")
+
+
+def test_cp949_rows_after_sample_window_are_decoded():
+    # 샘플 구간은 ASCII(= 유효한 UTF-8), cp949 행은 그 뒤에 등장
+    data = b"date,desc,out,in,bal\n" + _rows(3000) + LATE_CP949
+    assert data.index(LATE_CP949) > _CSV_SAMPLE_BYTES
+
+    raw = pd.concat(iter_spreadsheet(data, "statement.csv", batch_size=500))
+    assert len(raw) == 3002
+    assert raw.index.is_unique
+    assert raw.iloc[-1, 1] == "쿠팡"
+    assert not raw[1].str.contains("�").any()
+
+
+def test_mixed_encoding_csv_raises_instead_of_replacing():
+    # UTF-8 헤더 + 샘플 뒤 cp949 행: 어떤 후보로도 전체를 디코딩할 수 없음 → 깨진 글자 대신 오류
+    data = "거래일,적요,출금,입금,잔액\n".encode("utf-8") + _rows(3000) + LATE_CP949
+    assert data.index(LATE_CP949) > _CSV_SAMPLE_BYTES
+
+    with pytest.raises(ValueError, match="스프레드시트 파싱 실패"):
+        load_unified(data, "statement.csv")
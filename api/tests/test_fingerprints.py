@@ -0,0 +1,38 @@
+import pandas as pd
+
+from utils import transaction_fingerprints
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["date", "description", "amount", "balance"])
+
+
+ROWS = [
+    ("2024-01-03 10:00", "GS25 강남", -3000.0, 97000.0),
+    ("2024-01-05 12:00", "스타벅스", -5000.0, 92000.0),
+    ("2024-01-05 12:00", "스타벅스", -5000.0, 92000.0),  # 같은 날 동일 거래 2건
+    ("2024-01-09 09:00", "매출 입금", 50000.0, 142000.0),
+]
+
+
+def test_fingerprints_are_stable_across_reuploads():
+    first = transaction_fingerprints(_frame(ROWS), "강남점")
+    assert first.is_unique
+    assert first.tolist() == transaction_fingerprints(_frame(ROWS), "강남점").tolist()
+
+
+def test_overlapping_period_keeps_fingerprints_of_shared_rows():
+    # 앞 행이 잘리고 뒤에 새 거래가 붙은 파일: 겹치는 거래의 지문(동일 거래 순번 포함)은 그대로
+    before = transaction_fingerprints(_frame(ROWS), "강남점")
+    later = ROWS[1:] + [("2024-01-20 15:00", "쿠팡", -12000.0, 130000.0)]
+    after = transaction_fingerprints(_frame(later), "강남점")
+    assert after.tolist()[:3] == before.tolist()[1:]
+    assert after.iloc[3] not in set(before)
+
+
+def test_fingerprints_ignore_formatting_noise_but_not_branch():
+    base = transaction_fingerprints(_frame(ROWS), "강남점")
+    noisy = _frame([(d, f"  {desc.upper()}  ".replace(" ", "  "), a, b) for d, desc, a, b in ROWS])
+    noisy["date"] = pd.to_datetime(noisy["date"])
+    assert transaction_fingerprints(noisy, " 강남점 ").tolist() == base.tolist()
+    assert transaction_fingerprints(_frame(ROWS), "홍대점").tolist() != base.tolist()
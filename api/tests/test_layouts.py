@@ -0,0 +1,125 @@
+import copy
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import utils
+from utils import BANK_LAYOUTS, _detect_plan, register_layout
+
+WHEN = datetime(2024, 3, 5, 14, 30, 0)
+MONEY = {"out_amount": "1,500", "in_amount": "0", "balance": "98,500", "amount": "1,500"}
+
+
+def _statement(layout: dict, preamble: int = 3) -> pd.DataFrame:
+    """레이아웃 선언대로 만든 원본 시트 (iter_spreadsheet 출력처럼 정수 열 이름 + 문자열 셀)"""
+    header, row = [], []
+    for std, names in layout["columns"].items():
+        header.append(names[0])
+        if std == "date":
+            fmt = layout["date_format"].split(" ")[0] if "time" in layout["columns"] else layout["date_format"]
+            row.append(WHEN.strftime(fmt))
+        elif std == "time":
+            row.append(WHEN.strftime("%H:%M:%S"))
+        else:
+            row.append(MONEY.get(std, f"{layout['name']} {std}"))
+    lines = [["거래내역 조회", *[""] * (len(header) - 1)]] + [[""] * len(header)] * (preamble - 1)
+    return pd.DataFrame(lines + [header, row, row])
+
+
+@pytest.mark.parametrize("layout", BANK_LAYOUTS, ids=[l["name"] for l in BANK_LAYOUTS])
+def test_each_declared_layout_is_detected(layout):
+    raw = _statement(layout)
+    name, plan = _detect_plan(raw)
+    assert name == layout["name"]
+
+    out = plan(raw)
+    assert len(out) == 2
+    assert out["date"].iloc[0] == (pd.Timestamp(WHEN) if "time" in layout["columns"] or "%H" in layout["date_format"]
+                                   else pd.Timestamp(WHEN.date()))
+    assert out["amount"].iloc[0] == -1500.0
+    assert out.attrs["unparsable_money"] == 0
+
+
+def test_hana_header_is_not_taken_by_woori():
+    # 하나 헤더도 우리 시그니처(거래일시·적요·입금)를 포함하지만 우리 필수 컬럼이 없음 → 하나로 판정
+    hana = next(l for l in BANK_LAYOUTS if l["name"] == "hana")
+    assert _detect_plan(_statement(hana))[0] == "hana"
+
+
+def test_only_restricts_detection_to_one_layout():
+    kb = next(l for l in BANK_LAYOUTS if l["name"] == "kb")
+    assert _detect_plan(_statement(kb), only="woori") == ("woori", None)
+    assert _detect_plan(_statement(kb), only="kb")[0] == "kb"
+
+
+def test_generic_header_after_preamble():
+    raw = pd.DataFrame(
+        [["예금주: 홍길동", "", "", "", ""]] * 5
+        + [["거래일", "적요", "출금", "입금", "잔액"], ["2024-03-05", "스타벅스", "4,500", "", "95,500"]]
+    )
+    name, plan = _detect_plan(raw)
+    assert name == "generic"
+    out = plan(raw)
+    assert out["amount"].tolist() == [-4500.0]
+    assert out["balance"].tolist() == [95500.0]
+
+
+def test_missing_header_raises():
+    with pytest.raises(ValueError, match="헤더를 찾지 못했습니다"):
+        _detect_plan(pd.DataFrame([["a", "b"], ["1", "2"]]))
+
+
+@pytest.fixture
+def restore_layouts():
+    saved = copy.deepcopy(BANK_LAYOUTS)
+    yield
+    BANK_LAYOUTS[:] = saved
+    utils._build_layout_index()
+
+
+TOSS = {
+    "name": "toss",
+    "signature": {"toss_type": r"거래\s*유형", "toss_amount": r"거래\s*금액"},
+    "columns": {
+        "date": ["거래 일시"],
+        "description": ["적요"],
+        "amount": ["거래 금액"],
+        "balance": ["거래 후 잔액"],
+    },
+    "required": ["date", "description", "amount"],
+    "date_format": "%Y.%m.%d %H:%M:%S",
+}
+
+
+def test_register_layout_is_detected_before_existing(restore_layouts):
+    raw = pd.DataFrame([
+        ["거래 일시", "거래 유형", "적요", "거래 금액", "거래 후 잔액"],
+        ["2024.03.05 14:30:00", "출금", "쿠팡", "-12,000", "88,000"],
+    ])
+    # 등록 전: 범용 키워드로는 날짜 컬럼을 못 찾음
+    with pytest.raises(ValueError, match="필수 컬럼 누락"):
+        _detect_plan(raw)
+
+    register_layout(TOSS, before="woori")
+    assert [l["name"] for l in BANK_LAYOUTS].index("toss") == 0
+    name, plan = _detect_plan(raw)
+    assert name == "toss"
+    assert plan(raw)["amount"].tolist() == [-12000.0]
+
+
+def test_register_layout_replaces_same_name(restore_layouts):
+    register_layout(TOSS)
+    register_layout({**TOSS, "date_format": "%Y-%m-%d %H:%M:%S"}, before="kb")
+    names = [l["name"] for l in BANK_LAYOUTS]
+    assert names.count("toss") == 1
+    assert names.index("toss") == names.index("kb") - 1
+
+
+def test_register_layout_rejects_conflicting_token(restore_layouts):
+    before = [l["name"] for l in BANK_LAYOUTS]
+    with pytest.raises(ValueError, match="정의 충돌"):
+        register_layout({**TOSS, "name": "bad", "signature": {"tx_datetime": r"일시"}})
+    assert [l["name"] for l in BANK_LAYOUTS] == before
+    kb = next(l for l in BANK_LAYOUTS if l["name"] == "kb")
+    assert _detect_plan(_statement(kb))[0] == "kb"
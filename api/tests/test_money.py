@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from utils import STR_DTYPE, parse_money_series
+
+
+def parse(values, dtype=object):
+    vals, bad = parse_money_series(pd.Series(values, dtype=dtype))
+    return vals.tolist(), bad
+
+
+def test_currency_marks_commas_and_spaces_are_stripped():
+    assert parse(["1,000원", "₩2,500", " 3 000 ", "12,345.5", " 7,000"]) == (
+        [1000.0, 2500.0, 3000.0, 12345.5, 7000.0], 0,
+    )
+
+
+def test_parentheses_and_minus_are_negative():
+    assert parse(["(1,000)", "( 500원 )", "-3,000", "(0)"]) == ([-1000.0, -500.0, -3000.0, -0.0], 0)
+
+
+def test_placeholders_and_blanks_are_zero_without_counting_as_bad():
+    assert parse(["-", "", "  ", None, np.nan, "원", "()"]) == ([0.0] * 7, 0)
+
+
+def test_unparsable_cells_are_zero_and_counted_per_row():
+    vals, bad = parse(["abc", "1,000", "abc", "12-34"])
+    assert vals == [0.0, 1000.0, 0.0, 0.0]
+    assert bad == 3
+
+
+def test_numeric_and_arrow_string_columns():
+    assert parse([1000, -250.5, None], dtype="float64") == ([1000.0, -250.5, 0.0], 0)
+    assert parse(["1,000", None, "-"], dtype=STR_DTYPE) == ([1000.0, 0.0, 0.0], 0)
+
+
+def test_empty_series():
+    assert parse([]) == ([], 0)
@@ -0,0 +1,90 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from utils import apply_rules, compile_rules
+
+RULES = [
+    {"keyword": "스타벅스", "target": "any", "category": "카페", "is_fixed": False},
+    {"keyword": "GS25", "target": "vendor", "category_l1": "생활", "category_l2": "편의점"},
+    {"keyword": "월세", "target": "memo", "category": "임대료", "is_fixed": True},
+    {"keyword": "스타", "target": "description", "category": "기타"},  # 앞 규칙과 겹치는 키워드
+    {"keyword": "급여", "target": "DESCRIPTION", "category": "인건비", "is_fixed": True},
+    {"keyword": "", "target": "any", "category": "빈 키워드"},
+    {"keyword": "쿠팡", "target": "unknown", "category": "무시되는 대상"},
+    {"keyword": "쿠팡", "target": "any", "category_l3": "온라인"},
+    {"keyword": "gs25", "target": "any", "category": "중복 키워드(뒤 규칙)"},
+    {"keyword": None, "category": "키워드 없음"},
+]
+
+ROWS = [
+    {"description": "스타벅스 강남점", "memo": "", "vendor_normalized": "스타벅스"},
+    {"description": "스타필드", "memo": None, "vendor_normalized": None},
+    {"description": "GS25 역삼", "memo": "", "vendor_normalized": "GS25"},
+    {"description": "gs25 역삼", "memo": "", "vendor_normalized": np.nan},
+    {"description": "이체", "memo": "3월 월세", "vendor_normalized": ""},
+    {"description": "3월 급여", "memo": "", "vendor_normalized": None},
+    {"description": "쿠팡(주)", "memo": "", "vendor_normalized": "쿠팡"},
+    {"description": "알 수 없음", "memo": float("nan"), "vendor_normalized": None},
+]
+
+
+@pytest.fixture(params=["regex", "ahocorasick"])
+def matcher_backend(request, monkeypatch):
+    if request.param == "regex":
+        monkeypatch.setattr(utils, "ahocorasick", None)
+    elif utils.ahocorasick is None:
+        pytest.skip("pyahocorasick 미설치")
+    return request.param
+
+
+def _expected(df: pd.DataFrame, rules: list) -> pd.DataFrame:
+    return pd.DataFrame([apply_rules(r, rules) for r in df.to_dict("records")], index=df.index)
+
+
+def _assert_same(df: pd.DataFrame, rules: list):
+    got = compile_rules(rules).classify(df)
+    want = _expected(df, rules)
+    assert got["category"].tolist() == want["category"].tolist()
+    assert got["is_fixed"].tolist() == want["is_fixed"].tolist()
+    for c in ("category_l1", "category_l2", "category_l3"):
+        assert got[c].tolist() == want[c].tolist(), c
+
+
+def test_compiled_rules_match_apply_rules(matcher_backend):
+    _assert_same(pd.DataFrame(ROWS), RULES)
+
+
+def test_compiled_rules_match_apply_rules_randomized(matcher_backend):
+    rnd = random.Random(7)
+    words = ["스타", "스타벅스", "gs", "GS25", "월세", "급여", "쿠팡", "배민", "a", "ab", "b"]
+    targets = ["any", "description", "memo", "vendor", None]
+    for _ in range(30):
+        rules = [
+            {
+                "keyword": rnd.choice(words),
+                "target": rnd.choice(targets),
+                "category": rnd.choice(["A", "B", None]),
+                "category_l2": rnd.choice(["L2", None]),
+                "is_fixed": rnd.random() < 0.3,
+            }
+            for _ in range(rnd.randint(1, 12))
+        ]
+        rows = [
+            {
+                "description": " ".join(rnd.sample(words, 2)),
+                "memo": rnd.choice(["", None, rnd.choice(words)]),
+                "vendor_normalized": rnd.choice([None, rnd.choice(words).upper()]),
+            }
+            for _ in range(40)
+        ]
+        _assert_same(pd.DataFrame(rows), rules)
+
+
+def test_compiled_rules_without_rules_leave_rows_unclassified(matcher_backend):
+    got = compile_rules([]).classify(pd.DataFrame(ROWS))
+    assert set(got["category"]) == {"미분류"}
+    assert not got["is_fixed"].any()
@@ -0,0 +1,95 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+import main
+
+USER = "user-1"
+BRANCH = "강남점"
+
+STATEMENT = (
+    "거래일,적요,출금,입금,잔액\n"
+    "2024-01-03 10:00,GS25 강남,3000,0,97000\n"
+    "2024-01-05 12:00,스타벅스,5000,0,92000\n"
+    "2024-01-09 09:00,매출 입금,0,50000,142000\n"
+).encode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def fake_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(main, "PARSED_CACHE_DIR", str(tmp_path / "parsed"))
+    main.supabase.tables.clear()
+    main._rules_cache.clear()
+    yield main.supabase.tables
+    main.supabase.tables.clear()
+
+
+def upload(data: bytes = STATEMENT, branch: str = BRANCH):
+    return asyncio.run(main.process_upload(
+        user_id=USER, source=io.BytesIO(data), filename="statement.csv",
+        branch=branch, period_year=2024, period_month=1,
+    ))
+
+
+def test_failed_insert_leaves_no_upload_and_retry_imports(fake_db, monkeypatch):
+    real_bulk_insert = main.bulk_insert
+
+    async def failing_bulk_insert(table, recs, **kw):
+        raise RuntimeError("transactions insert failed")
+
+    monkeypatch.setattr(main, "bulk_insert", failing_bulk_insert)
+    with pytest.raises(RuntimeError):
+        upload()
+    assert fake_db.get("uploads", []) == []
+    assert fake_db.get("transactions", []) == []
+
+    monkeypatch.setattr(main, "bulk_insert", real_bulk_insert)
+    result = upload()
+    assert not result.get("already_imported")
+    assert result["total_tx"] == 3
+    assert [u["status"] for u in fake_db["uploads"]] == ["processed"]
+    assert len(fake_db["transactions"]) == 3
+
+    again = upload()
+    assert again["already_imported"]
+    assert [u["id"] for u in again["uploads"]] == result["upload_ids"]
+
+
+def test_processing_upload_is_not_reported_as_imported(fake_db):
+    result = upload()
+    fake_db["uploads"][0]["status"] = "processing"  # 다른 요청이 아직 저장 중인 상태
+    assert asyncio.run(main.find_imported_upload(USER, result["file_hash"])) == []
+
+
+def test_reupload_with_only_known_rows_is_recorded(fake_db):
+    upload()
+    # 내용은 다르지만(줄바꿈 추가) 거래는 전부 이미 저장된 파일
+    overlap = STATEMENT + b"\n"
+    first = upload(overlap)
+    assert not first.get("already_imported")
+    assert first["total_tx"] == 0
+    assert len(first["upload_ids"]) == 1
+    assert len(fake_db["transactions"]) == 3
+
+    again = upload(overlap)
+    assert again["already_imported"]
+    assert [u["id"] for u in again["uploads"]] == first["upload_ids"]
+
+
+def test_branch_is_normalized_for_fingerprints_lookup_and_storage(fake_db):
+    upload(branch=BRANCH)
+    result = upload(STATEMENT + b"\n", branch=f"  {BRANCH} ")
+    assert result["total_tx"] == 0
+    assert {u["branch"] for u in fake_db["uploads"]} == {BRANCH}
+    assert {t["branch"] for t in fake_db["transactions"]} == {BRANCH}
+
+
+def test_processed_file_has_no_internal_columns(fake_db):
+    result = upload()
+    stored = main.load_processed(result["file_hash"])
+    assert len(stored) == 3
+    assert not set(stored.columns) & {"fingerprint", "year", "month", "vendor_normalized"}
+    assert os.listdir(main.PROCESSED_DIR) == [f"{result['file_hash']}.parquet"]
@@ -2,12 +2,27 @@ import os
 import re
 import io
 import csv
+import codecs
+import zipfile
+import hashlib
 import tempfile
-from typing import Dict, Any, Optional, List
+from functools import lru_cache
+from itertools import zip_longest
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Iterator, Callable
 
 import pandas as pd
 import numpy as np
-from xlsx2csv import Xlsx2csv
+
+try:
+    import ahocorasick  # pyahocorasick (선택) — 없으면 정규식 매처로 대체
+except ImportError:
+    ahocorasick = None
+
+try:
+    import pyarrow  # noqa: F401 — Arrow 문자열 컬럼 (없으면 object 컬럼)
+    STR_DTYPE: Any = pd.StringDtype("pyarrow")
+except ImportError:
+    STR_DTYPE = object
 
 # =========================
 # 1) 벤더(거래처) 이름 정규화
@@ -20,193 +35,592 @@ NORMALIZE_MAP = {
     r"seven\s*eleven|세븐일레븐|7\-?11": "세븐일레븐",
 }
 
+# 패턴 순서 = 우선순위: 앵커된 전방탐색 alternation 으로 "먼저 정의된 패턴 우선" 을 한 번의 match 로 판정
+_VENDOR_RX = re.compile(
+    "^(?:" + "|".join(f"(?=.*?(?P<v{i}>{pat}))" for i, pat in enumerate(NORMALIZE_MAP)) + ")",
+    re.S,
+)
+_VENDOR_NAMES = list(NORMALIZE_MAP.values())
+
+# 가맹점 사전 (load_merchant_dictionary) — 키워드 포함 시 대표 상호로 치환, 파일 순서 = 우선순위
+_MERCHANT_MATCHER = None
+_MERCHANT_NAMES: List[str] = []
+VENDOR_CACHE_SIZE = 100_000
+
+
+@lru_cache(maxsize=VENDOR_CACHE_SIZE)
+def _normalize_vendor_cached(s_raw: str) -> str:
+    s = s_raw.lower()
+    m = _VENDOR_RX.match(s)
+    if m:
+        return _VENDOR_NAMES[int(m.lastgroup[1:])]
+    if _MERCHANT_MATCHER is not None:
+        idx = _MERCHANT_MATCHER.first(s)
+        if idx != _NO_MATCH:
+            return _MERCHANT_NAMES[idx]
+    return s_raw
+
 def normalize_vendor(text: str) -> str:
     if text is None:
         return ""
-    s_raw = str(text).strip()
-    s = s_raw.lower()
-    for pat, rep in NORMALIZE_MAP.items():
-        if re.search(pat, s):
-            return rep
-    return s_raw
+    return _normalize_vendor_cached(str(text).strip())
+
+def normalize_vendor_series(s: pd.Series) -> pd.Series:
+    """고유 거래내용마다 한 번만 정규화(factorize) 후 행으로 되돌림 — 결과는 요청 간 LRU 로 재사용"""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    mapped = np.array([normalize_vendor(u) for u in uniques] + [""], dtype=object)
+    return pd.Series(mapped[codes], index=s.index)
+
+def load_merchant_dictionary(path: str) -> int:
+    """
+    가맹점 사전 CSV 로드 (헤더: keyword,vendor). 키워드는 소문자 부분일치.
+    수천 건이어도 다중 패턴 매처 한 번으로 판정한다. 반환: 등록된 키워드 수
+    """
+    global _MERCHANT_MATCHER, _MERCHANT_NAMES
+    keywords: Dict[str, int] = {}
+    names: List[str] = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            kw = (row.get("keyword") or "").strip().lower()
+            vendor = (row.get("vendor") or "").strip()
+            if kw and vendor and kw not in keywords:
+                keywords[kw] = len(names)
+                names.append(vendor)
+
+    _MERCHANT_MATCHER = _KeywordMatcher(keywords) if keywords else None
+    _MERCHANT_NAMES = names
+    _normalize_vendor_cached.cache_clear()
+    return len(keywords)
 
 
 # =========================================
 # 2) 스프레드시트 로더 (header=None 기본)
+#    확장자 대신 선두 바이트로 포맷을 한 번 판정 → 파서 1개만 실행
 # =========================================
-def load_spreadsheet(content: bytes, filename: str) -> pd.DataFrame:
-    name = (filename or "").lower()
-    ext = os.path.splitext(name)[1]
-    errors: List[str] = []
+DEFAULT_BATCH_ROWS = 5000
+
+_ZIP_MAGIC = b"PK\x03\x04"
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_HTML_MARKERS = (b"<html", b"<table", b"<!doctype html", b"<meta", b"<head")
+_SNIFF_BYTES = 4096
+_HTML_CHARSET = re.compile(rb"charset=[\"']?([\w-]+)", re.I)
 
-    # XLSX
-    if ext in (".xlsx", ".xlsm", ".xltx", ".xltm", ""):
-        try:
-            return pd.read_excel(io.BytesIO(content), engine="openpyxl", header=None, dtype=str)
-        except Exception as e:
-            errors.append(f"openpyxl: {e}")
 
-    # XLS
-    if ext == ".xls":
+def sniff_format(fh) -> str:
+    """
+    파일 포맷 판정: "xlsx" | "xlsb" | "xls" | "html" | "text"
+    - ZIP(OOXML): ZIP 디렉터리의 xl/workbook.xml / xl/workbook.bin 으로 구분
+    - OLE2(BIFF): 구형 .xls
+    - HTML: .xls 로 내려받아지는 은행 HTML 표
+    - 그 외: 텍스트(CSV)
+    """
+    fh.seek(0)
+    head = fh.read(_SNIFF_BYTES)
+    fh.seek(0)
+
+    if head.startswith(_ZIP_MAGIC):
         try:
-            return pd.read_excel(io.BytesIO(content), engine="xlrd", header=None, dtype=str)
-        except Exception as e:
-            errors.append(f"xlrd: {e}")
+            with zipfile.ZipFile(fh) as zf:
+                names = set(zf.namelist())
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"손상된 ZIP(OOXML) 파일: {e}")
+        finally:
+            fh.seek(0)
+        if "xl/workbook.bin" in names:
+            return "xlsb"
+        if "xl/workbook.xml" in names:
+            return "xlsx"
+        raise ValueError("엑셀 통합문서가 아닌 ZIP 파일입니다.")
 
-    # XLSB
-    if ext == ".xlsb":
+    if head.startswith(_OLE2_MAGIC):
+        return "xls"
+
+    probe = head
+    if head[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        probe = head.decode("utf-16", errors="ignore").encode("utf-8")
+    probe = probe.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if probe.startswith(b"<") and any(m in probe for m in _HTML_MARKERS):
+        return "html"
+
+    return "text"
+
+
+def file_content_hash(fh, chunk_size: int = 1024 * 1024) -> str:
+    """파일 내용 SHA-256 (청크 단위로 읽어 전체를 메모리에 올리지 않음)"""
+    h = hashlib.sha256()
+    fh.seek(0)
+    while chunk := fh.read(chunk_size):
+        h.update(chunk)
+    fh.seek(0)
+    return h.hexdigest()
+
+
+def upload_fingerprint(content_hash: str, branch: str, period: str) -> str:
+    """같은 파일이라도 지점/기간이 다르면 다른 업로드로 취급"""
+    return hashlib.sha256(f"{content_hash}|{branch.strip()}|{period}".encode("utf-8")).hexdigest()
+
+
+def _cell_str(v) -> Any:
+    """pd.read_excel(dtype=str) 와 같은 규칙으로 셀 값을 문자열화 (빈 셀 → NaN)"""
+    if v is None:
+        return np.nan
+    if isinstance(v, float):
+        if v != v:
+            return np.nan
+        if v.is_integer():
+            return str(int(v))
+    return str(v)
+
+
+def _read_html(fh) -> pd.DataFrame:
+    """HTML 표(.xls 위장) → 행 수가 가장 많은 표를 header=None 문자열 DataFrame 으로"""
+    raw = fh.read()
+    m = _HTML_CHARSET.search(raw[:_SNIFF_BYTES])
+    if m:
+        encodings = [m.group(1).decode("ascii")]
+    elif raw[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        encodings = ["utf-16"]
+    else:
+        encodings = ["utf-8-sig", "cp949"]
+    for enc in encodings:
         try:
-            return pd.read_excel(io.BytesIO(content), engine="pyxlsb", header=None, dtype=str)
-        except Exception as e:
-            errors.append(f"pyxlsb: {e}")
+            text = raw.decode(enc)
+            break
+        except (UnicodeDecodeError, LookupError):
+            continue
+    else:
+        text = raw.decode("cp949", errors="replace")
 
-    # CSV
-    if ext == ".csv":
-        for enc in ("utf-8-sig", "cp949", "euc-kr"):
-            try:
-                return pd.read_csv(io.BytesIO(content), encoding=enc, engine="python", header=None, dtype=str)
-            except Exception as e:
-                errors.append(f"csv({enc}): {e}")
+    tables = pd.read_html(io.StringIO(text), thousands=None)
+    df = max(tables, key=len)
+    if list(df.columns) != list(range(df.shape[1])):
+        # <thead> 가 컬럼명으로 빠진 경우 다시 첫 행으로 되돌린다
+        header = [c[-1] if isinstance(c, tuple) else c for c in df.columns]
+        df = pd.concat([pd.DataFrame([header]), pd.DataFrame(df.to_numpy())], ignore_index=True)
+    return df.map(_cell_str).astype(STR_DTYPE)
+
+
+def _read_frame(fh, fmt: str) -> pd.DataFrame:
+    if fmt == "xlsx":
+        return pd.read_excel(fh, engine="openpyxl", header=None, dtype=str)
+    if fmt == "xls":
+        return pd.read_excel(fh, engine="xlrd", header=None, dtype=str)
+    if fmt == "xlsb":
+        return pd.read_excel(fh, engine="pyxlsb", header=None, dtype=str).astype(STR_DTYPE)
+    if fmt == "html":
+        return _read_html(fh)
+    return pd.concat(list(_iter_csv(fh, DEFAULT_BATCH_ROWS)))
 
-    # XLSX2CSV fallback
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=True) as f:
-            f.write(content)
-            f.flush()
-            out = io.StringIO()
-            Xlsx2csv(f.name, outputencoding="utf-8", skip_empty_rows=True).convert(out)
-            csv_text = out.getvalue()
-            return pd.read_csv(io.StringIO(csv_text), engine="python", header=None, on_bad_lines="skip", dtype=str)
-    except Exception as e:
-        errors.append(f"xlsx2csv: {e}")
 
-    # Final CSV sniff
+def load_spreadsheet(content: bytes, filename: str, meta: Optional[dict] = None) -> pd.DataFrame:
+    fh = io.BytesIO(content)
+    fmt = sniff_format(fh)
+    if meta is not None:
+        meta["format"] = fmt
+    print(f"📄 포맷 감지: {filename} → {fmt}")
+
     try:
-        text = content.decode("utf-8-sig", errors="ignore")
-        return pd.read_csv(io.StringIO(text), engine="python", header=None, dtype=str)
+        return _read_frame(fh, fmt)
     except Exception as e:
-        errors.append(f"csv-final: {e}")
-
-    raise ValueError("스프레드시트 파싱 실패 → " + " | ".join(errors))
+        raise ValueError(f"스프레드시트 파싱 실패 ({fmt}) → {e}")
 
 
 # =========================================
-# 3) 우리은행 엑셀 전용 파서
+# 2-B) 스트리밍 로더 (행 배치 단위, 메모리 = 배치 크기)
 # =========================================
-def parse_woori_excel(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """우리은행 거래내역 파일 구조 감지 및 변환"""
-    if df.shape[1] < 5:
-        return None
+def _columns_frame(buf: List[tuple], offset: int) -> pd.DataFrame:
+    """행 버퍼를 열 단위로 뒤집어 Arrow 문자열 컬럼으로 바로 만든다 (셀마다 파이썬 str 을 남기지 않음)"""
+    cols = zip_longest(*buf)
+    return pd.DataFrame(
+        {j: pd.array([_cell_str(v) for v in col], dtype=STR_DTYPE) for j, col in enumerate(cols)},
+        index=range(offset, offset + len(buf)),
+    )
 
-    header_row = None
-    for i in range(min(30, len(df))):
-        row = "".join(str(x) for x in df.iloc[i].tolist())
-        if "거래일시" in row and "적요" in row and "입금" in row:
-            header_row = i
-            break
-    if header_row is None:
-        return None
 
-    df_data = df.iloc[header_row + 1:].copy()
-    df_data.columns = [str(x).strip() for x in df.iloc[header_row].tolist()]
-    needed = ["거래일시", "적요", "기재내용", "지급(원)", "입금(원)", "거래후 잔액(원)", "취급점"]
-    if not all(c in df_data.columns for c in needed):
-        return None
+def _rows_to_frames(rows: Iterable[tuple], batch_size: int) -> Iterator[pd.DataFrame]:
+    """행 튜플 이터레이터 → header=None 문자열 DataFrame 배치 (index = 파일 기준 행 번호)"""
+    buf: List[tuple] = []
+    offset = 0
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= batch_size:
+            yield _columns_frame(buf, offset)
+            offset += len(buf)
+            buf = []
+    if buf:
+        yield _columns_frame(buf, offset)
 
-    # 숫자 처리
-    for c in ["지급(원)", "입금(원)", "거래후 잔액(원)"]:
-        df_data[c] = (
-            df_data[c]
-            .astype(str)
-            .str.replace(",", "")
-            .str.replace("원", "")
-            .replace("-", "0")
-            .replace("", "0")
-            .astype(float)
-        )
 
-    df_data = df_data[needed].dropna(subset=["거래일시"]).reset_index(drop=True)
-    df_data["거래일시"] = pd.to_datetime(df_data["거래일시"], errors="coerce")
-
-    # 표준화
-    df_data.rename(
-        columns={
-            "거래일시": "date",
-            "적요": "type",
-            "기재내용": "description",
-            "지급(원)": "out_amount",
-            "입금(원)": "in_amount",
-            "거래후 잔액(원)": "balance",
-            "취급점": "branch",
-        },
-        inplace=True,
-    )
+def _iter_xlsx(fh, batch_size: int) -> Iterator[pd.DataFrame]:
+    import openpyxl
+
+    wb = openpyxl.load_workbook(fh, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # 잘못된 dimension 태그로 행이 잘리는 파일 대비 (pandas 와 동일)
+        yield from _rows_to_frames(ws.iter_rows(values_only=True), batch_size)
+    finally:
+        wb.close()
+
+
+def _iter_xls(fh, batch_size: int) -> Iterator[pd.DataFrame]:
+    import xlrd
+
+    book = xlrd.open_workbook(file_contents=fh.read(), on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+
+        def rows():
+            for i in range(sheet.nrows):
+                vals = []
+                for cell in sheet.row(i):
+                    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                        vals.append(None)
+                    elif cell.ctype == xlrd.XL_CELL_DATE:
+                        vals.append(xlrd.xldate.xldate_as_datetime(cell.value, book.datemode))
+                    else:
+                        vals.append(cell.value)
+                yield vals
+
+        yield from _rows_to_frames(rows(), batch_size)
+    finally:
+        book.release_resources()
+
+
+_CSV_SAMPLE_BYTES = 64 * 1024
+_CSV_ENCODINGS = ("utf-8", "cp949")  # cp949 ⊃ euc-kr
+
+
+def _detect_csv_encoding(sample: bytes) -> str:
+    """BOM → 샘플 바이트 엄격 디코딩 순으로 한 번만 판정 (끝에서 잘린 멀티바이트 문자는 허용)"""
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    if sample[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return "utf-16"
+    for enc in _CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "cp949"
+
+
+def _csv_width(text: str) -> int:
+    """샘플 구간의 최대 필드 수 — 제목행이 짧은 은행 CSV 도 C 엔진이 한 번에 읽도록 열 수를 고정"""
+    lines = text.splitlines()[:-1] or text.splitlines()  # 잘린 마지막 줄 제외
+    return max((len(r) for r in csv.reader(lines)), default=1) or 1
+
+
+def _iter_csv(fh, batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    CSV 스트리밍: 인코딩/열 수는 앞부분 샘플로 판정 → C 엔진 chunksize 읽기.
+    (pyarrow 엔진은 행마다 열 수가 다른 은행 CSV 를 거부하고 chunksize 도 지원하지 않아 쓰지 않음)
+    - 디코딩은 엄격 모드: 샘플 뒤에서 다른 인코딩 바이트가 나오면 다음 후보 인코딩으로 처음부터 다시 읽고
+      이미 내보낸 행 수만큼 건너뛴다 (구분자/따옴표/줄바꿈은 ASCII 라 행 경계는 인코딩과 무관)
+    - 모든 후보가 실패하면 깨진 문자로 대체하지 않고 ValueError
+    """
+    fh.seek(0)
+    sample = fh.read(_CSV_SAMPLE_BYTES)
+    detected = _detect_csv_encoding(sample)
+    width = _csv_width(sample.decode(detected, errors="replace"))
+    candidates = [detected] + [e for e in _CSV_ENCODINGS if e != detected and not detected.startswith(e)]
+
+    emitted = 0
+    for i, enc in enumerate(candidates):
+        fh.seek(0)
+        skip = emitted
+        try:
+            reader = pd.read_csv(
+                fh,
+                encoding=enc,
+                engine="c",
+                header=None,
+                names=range(width),
+                dtype=STR_DTYPE,
+                chunksize=batch_size,
+            )
+            for chunk in reader:
+                if skip:
+                    drop = min(skip, len(chunk))
+                    skip -= drop
+                    chunk = chunk.iloc[drop:]
+                    if chunk.empty:
+                        continue
+                emitted += len(chunk)
+                yield chunk
+            return
+        except UnicodeDecodeError as e:
+            if i + 1 < len(candidates):
+                print(f"⚠️ CSV {enc} 디코딩 실패 ({emitted}행 이후) → {candidates[i + 1]} 로 다시 읽음")
+                continue
+            raise ValueError(f"스프레드시트 파싱 실패 (text) → 인코딩 판별 실패 ({', '.join(candidates)}): {e}")
+        except pd.errors.ParserError as e:
+            raise ValueError(f"CSV 파싱 실패 ({enc}) → {e}")
 
-    df_data["amount"] = df_data["in_amount"] - df_data["out_amount"]
-    df_data["tx_type"] = df_data["amount"].apply(lambda x: "IN" if x > 0 else "OUT")
 
-    return df_data
+_STREAM_READERS = {"xlsx": _iter_xlsx, "xls": _iter_xls, "text": _iter_csv}
+
+
+def iter_spreadsheet(
+    source,
+    filename: str,
+    batch_size: int = DEFAULT_BATCH_ROWS,
+    meta: Optional[dict] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    스프레드시트를 header=None 문자열 DataFrame 으로 batch_size 행씩 순차 반환.
+    - source: bytes 또는 seek 가능한 바이너리 파일 객체 (UploadFile.file 등)
+    - xlsx: openpyxl read-only 행 순회 / xls: xlrd 행 순회 / text: chunksize 읽기
+    - xlsb, html 은 한 번에 읽은 뒤 배치로 잘라 반환
+    - meta 를 넘기면 감지된 포맷을 meta["format"] 에 기록
+    """
+    fh = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    fmt = sniff_format(fh)
+    if meta is not None:
+        meta["format"] = fmt
+    print(f"📄 포맷 감지: {filename} → {fmt}")
+
+    try:
+        reader = _STREAM_READERS.get(fmt)
+        if reader is not None:
+            yield from reader(fh, batch_size)
+        else:
+            df = _read_frame(fh, fmt)
+            for start in range(0, len(df), batch_size):
+                yield df.iloc[start:start + batch_size]
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"스프레드시트 파싱 실패 ({fmt}) → {e}")
+
 
 # =========================================
-# 3-B) 국민은행 엑셀 전용 파서
+# 3) 은행별 레이아웃 레지스트리 → 배치 변환기
+#    감지는 앞부분 행(head)으로 한 번, 변환은 배치마다 반복
 # =========================================
-def parse_kb_excel(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """국민은행 거래내역 파일 구조 감지 및 변환"""
-    if df.shape[1] < 5:
-        return None
+BatchTransform = Callable[[pd.DataFrame], pd.DataFrame]
 
-    header_row = None
-    for i in range(min(30, len(df))):
-        row_text = "".join(str(x) for x in df.iloc[i].tolist())
-        # ✅ 국민은행은 "거래일시" + "보낸분/받는분" 컬럼으로 판단
-        if "거래일시" in row_text and ("보낸분" in row_text or "받는분" in row_text):
-            header_row = i
-            break
-    if header_row is None:
-        return None
+_MONEY_STRIP = r"[₩원,\s]"
+_MONEY_PLACEHOLDERS = ("", "-")
 
-    df_data = df.iloc[header_row + 1:].copy()
-    df_data.columns = [str(x).strip() for x in df.iloc[header_row].tolist()]
 
-    needed = ["거래일시", "보낸분/받는분", "출금액(원)", "입금액(원)", "잔액(원)"]
-    if not all(c in df_data.columns for c in needed):
-        return None
+def _rows_after(batch: pd.DataFrame, header_row) -> pd.DataFrame:
+    return batch[batch.index > header_row]
 
-    # ✅ 숫자 컬럼 정리
-    for c in ["출금액(원)", "입금액(원)", "잔액(원)"]:
-        df_data[c] = (
-            df_data[c]
-            .astype(str)
-            .str.replace(",", "")
-            .str.replace("원", "")
-            .replace("-", "0")
-            .replace("", "0")
-            .astype(float)
-        )
 
-    df_data = df_data[needed].dropna(subset=["거래일시"]).reset_index(drop=True)
-    df_data["거래일시"] = pd.to_datetime(df_data["거래일시"], errors="coerce")
-
-    # ✅ 표준화
-    df_data.rename(
-        columns={
-            "거래일시": "date",
-            "보낸분/받는분": "description",
-            "출금액(원)": "out_amount",
-            "입금액(원)": "in_amount",
-            "잔액(원)": "balance",
+def _column_at(data: pd.DataFrame, pos: Optional[int]) -> pd.Series:
+    """배치마다 열 개수가 다를 수 있으므로 위치 기반으로 안전하게 꺼낸다"""
+    if pos is None or pos >= data.shape[1]:
+        return pd.Series(np.nan, index=data.index, dtype=object)
+    return data.iloc[:, pos]
+
+
+def _norm_str(x) -> str:
+    if x is None or x is pd.NA:
+        return ""
+    try:
+        return str(x).replace("\u00a0", " ").strip()
+    except Exception:
+        return ""
+
+
+def parse_money_series(s: pd.Series) -> Tuple[np.ndarray, int]:
+    """
+    금액 컬럼 일괄 변환 (₩ / 원 / 콤마 / 공백 제거, (1,000) → -1000, 빈칸·'-' → 0).
+    같은 금액 문자열은 한 번만 정리(factorize)한 뒤 행으로 되돌린다.
+    반환: (float64 배열, 숫자로 읽지 못한 셀 수) — 읽지 못한 셀은 0 처리
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    txt = pd.Series(uniques, dtype=object).astype(str).str.replace(_MONEY_STRIP, "", regex=True)
+    neg = (txt.str.startswith("(") & txt.str.endswith(")")).to_numpy(dtype=bool)
+    txt = txt.where(~neg, txt.str.slice(1, -1))
+    empty = txt.isin(_MONEY_PLACEHOLDERS).to_numpy()
+
+    try:
+        vals = txt.mask(empty).astype(np.float64)
+    except ValueError:
+        vals = pd.to_numeric(txt.mask(empty), errors="coerce")
+    bad = vals.isna().to_numpy() & ~empty
+
+    vals = vals.fillna(0.0).to_numpy(dtype=np.float64, copy=True)
+    vals[neg] *= -1
+    # code -1 (빈 셀) → 마지막 칸 0
+    vals = np.append(vals, 0.0)
+    bad = np.append(bad, False)
+    return vals[codes], int(bad[codes].sum())
+
+
+def _parse_dates(s: pd.Series, fmt: Optional[str] = None) -> pd.Series:
+    """지정 포맷으로 한 번에 변환, 포맷과 다른 셀만 자동 추론으로 다시 변환"""
+    if not fmt:
+        return pd.to_datetime(s, errors="coerce")
+    out = pd.to_datetime(s, format=fmt, errors="coerce")
+    miss = out.isna() & s.notna()
+    if miss.any():
+        out[miss] = pd.to_datetime(s[miss], errors="coerce")
+    return out
+
+
+# 은행/카드사 거래내역 레이아웃 (위에 있을수록 우선)
+#   signature : 헤더 행에 모두 있어야 하는 토큰 {토큰명: 정규식} — 감지 인덱스 키
+#   columns   : 표준 컬럼 → 원본 헤더 후보 (먼저 나오는 이름 사용, 열 순서 = 출력 순서)
+#   required  : 없으면 이 레이아웃이 아닌 것으로 판단하는 표준 컬럼
+#   date_format / amount_sign : 날짜 포맷(다르면 자동 추론), 단일 금액 컬럼 부호(카드 이용금액 = 지출)
+BANK_LAYOUTS: List[Dict[str, Any]] = [
+    {
+        "name": "woori",
+        "signature": {"tx_datetime": r"거래일시", "jeokyo": r"적요", "deposit": r"입금"},
+        "columns": {
+            "date": ["거래일시"],
+            "type": ["적요"],
+            "description": ["기재내용"],
+            "out_amount": ["지급(원)"],
+            "in_amount": ["입금(원)"],
+            "balance": ["거래후 잔액(원)"],
+            "branch": ["취급점"],
         },
-        inplace=True,
-    )
+        "required": ["date", "type", "description", "out_amount", "in_amount", "balance", "branch"],
+        "date_format": "%Y.%m.%d %H:%M:%S",
+    },
+    {
+        "name": "kb",
+        "signature": {"party": r"보낸분|받는분", "tx_datetime": r"거래일시"},
+        "columns": {
+            "date": ["거래일시"],
+            "description": ["보낸분/받는분"],
+            "out_amount": ["출금액(원)"],
+            "in_amount": ["입금액(원)"],
+            "balance": ["잔액(원)"],
+        },
+        "required": ["date", "description", "out_amount", "in_amount", "balance"],
+        "date_format": "%Y.%m.%d %H:%M:%S",
+    },
+    {
+        "name": "shinhan",
+        "signature": {"tx_date": r"거래일자", "tx_time": r"거래시간"},
+        "columns": {
+            "date": ["거래일자"],
+            "time": ["거래시간"],
+            "type": ["적요"],
+            "out_amount": ["출금(원)", "출금"],
+            "in_amount": ["입금(원)", "입금"],
+            "description": ["내용"],
+            "balance": ["잔액(원)", "잔액"],
+            "branch": ["거래점"],
+        },
+        "required": ["date", "out_amount", "in_amount", "description"],
+        "date_format": "%Y-%m-%d %H:%M:%S",
+    },
+    {
+        "name": "hana",
+        "signature": {"counterparty": r"의뢰인|수취인", "tx_datetime": r"거래일시"},
+        "columns": {
+            "date": ["거래일시"],
+            "type": ["적요"],
+            "description": ["의뢰인/수취인", "의뢰인/수취인명"],
+            "in_amount": ["입금"],
+            "out_amount": ["출금"],
+            "balance": ["거래후잔액", "거래후 잔액"],
+            "branch": ["거래점"],
+            "memo": ["거래특이사항"],
+        },
+        "required": ["date", "description", "in_amount", "out_amount"],
+        "date_format": "%Y-%m-%d %H:%M:%S",
+    },
+    {
+        "name": "nh",
+        "signature": {"tx_record": r"거래기록사항", "tx_datetime": r"거래일시"},
+        "columns": {
+            "date": ["거래일시"],
+            "out_amount": ["출금금액(원)", "출금금액"],
+            "in_amount": ["입금금액(원)", "입금금액"],
+            "balance": ["거래후잔액(원)", "거래후잔액"],
+            "type": ["거래내용"],
+            "description": ["거래기록사항"],
+            "branch": ["거래점"],
+            "memo": ["이체메모"],
+        },
+        "required": ["date", "out_amount", "in_amount", "description"],
+        "date_format": "%Y/%m/%d %H:%M:%S",
+    },
+    {
+        "name": "ibk",
+        "signature": {"counter_account": r"상대계좌", "tx_datetime": r"거래일시"},
+        "columns": {
+            "date": ["거래일시"],
+            "out_amount": ["출금"],
+            "in_amount": ["입금"],
+            "balance": ["거래후 잔액", "거래후잔액"],
+            "description": ["상대계좌예금주명", "거래내용"],
+            "type": ["거래구분"],
+            "memo": ["메모"],
+        },
+        "required": ["date", "out_amount", "in_amount", "description"],
+        "date_format": "%Y-%m-%d %H:%M:%S",
+    },
+    {
+        "name": "card",
+        "signature": {"merchant": r"가맹점", "card_amount": r"이용금액|승인금액"},
+        "columns": {
+            "date": ["이용일자", "승인일자", "이용일", "거래일자"],
+            "time": ["이용시간", "승인시간"],
+            "description": ["가맹점명", "이용가맹점", "이용하신 가맹점", "가맹점"],
+            "amount": ["이용금액", "이용금액(원)", "승인금액", "승인금액(원)"],
+            "memo": ["이용구분", "할부개월"],
+        },
+        "required": ["date", "description", "amount"],
+        "date_format": "%Y.%m.%d",
+        "amount_sign": -1,
+    },
+]
+
+_MONEY_COLUMNS = ("out_amount", "in_amount", "balance", "amount")
+
+
+def _layout_transform(layout: Dict[str, Any], pos: Dict[str, int], data: pd.DataFrame) -> pd.DataFrame:
+    """레이아웃 선언대로 배치를 표준 컬럼으로 변환 (컬럼 단위 벡터 연산)"""
+    out = pd.DataFrame({std: _column_at(data, p) for std, p in pos.items()}, index=data.index)
+    out = out.dropna(subset=["date"])
+
+    unparsable = 0
+    for c in _MONEY_COLUMNS:
+        if c in out.columns:
+            out[c], bad = parse_money_series(out[c])
+            unparsable += bad
+
+    date_raw = out["date"].astype(str)
+    fmt = layout.get("date_format")
+    if "time" in out.columns:
+        date_raw = date_raw + " " + out.pop("time").fillna("").astype(str)
+        fmt = f"{fmt} %H:%M:%S" if fmt and "%H" not in fmt else fmt
+    out["date"] = _parse_dates(date_raw.str.strip(), fmt)
+
+    if "amount" in out.columns:
+        out["amount"] = out["amount"] * layout.get("amount_sign", 1)
+    else:
+        out["amount"] = out.get("in_amount", 0.0) - out.get("out_amount", 0.0)
+    out["tx_type"] = np.where(out["amount"] > 0, "IN", "OUT")
+    if "balance" not in out.columns:
+        out["balance"] = 0.0
+
+    out.attrs["unparsable_money"] = unparsable
+    return out
 
-    # ✅ 금액 계산: 입금 - 출금
-    df_data["amount"] = df_data["in_amount"] - df_data["out_amount"]
-    df_data["tx_type"] = df_data["amount"].apply(lambda x: "IN" if x > 0 else "OUT")
 
-    return df_data
+def _layout_plan(layout: Dict[str, Any], cells: List[str], header_row) -> Optional[BatchTransform]:
+    pos: Dict[str, int] = {}
+    for std, names in layout["columns"].items():
+        p = next((cells.index(n) for n in names if n in cells), None)
+        if p is not None:
+            pos[std] = p
+        elif std in layout["required"]:
+            return None
+    return lambda batch: _layout_transform(layout, pos, _rows_after(batch, header_row))
+
 
 # =========================================
-# 4) 범용 헤더 탐색 & 컬럼 통합 (기존)
+# 4) 범용 헤더 탐색 & 컬럼 통합
 # =========================================
 _HEADER_KEYWORDS = {
     "date":  [r"날짜", r"거래일", r"일자", r"승인일자", r"거래\s*시간"],
@@ -215,102 +629,233 @@ _HEADER_KEYWORDS = {
     "dep":   [r"입금", r"받은금액", r"credit"],
     "wd":    [r"출금", r"보낸금액", r"debit"],
     "amt":   [r"금액", r"이체금액", r"거래금액"],
+    "bal":   [r"잔액", r"balance"],
 }
+_GENERIC_KEYS = ("date", "desc", "amt", "dep", "wd")
+_BALANCE_COLUMNS = ['잔액', '거래후 잔액', '잔액(원)']
+HEADER_SCAN_ROWS = 80
+BANK_SCAN_ROWS = 30
 
-def _norm_str(x) -> str:
-    try:
-        return str(x).replace("\u00a0", " ").strip()
-    except Exception:
-        return ""
+def _generic_transform(data: pd.DataFrame, pos: Dict[str, Optional[int]]) -> pd.DataFrame:
+    data = data.dropna(how="all")
+    unparsable = 0
 
-def _has_kw(s: str, pats) -> bool:
-    s2 = _norm_str(s)
-    return any(re.search(p, s2, re.I) for p in pats)
-
-def _guess_header_row(df: pd.DataFrame, scan_rows: int = 80) -> Optional[int]:
-    for i in range(min(scan_rows, len(df))):
-        row = [_norm_str(v) for v in df.iloc[i].tolist()]
-        hits = 0
-        for cell in row:
-            if _has_kw(cell, _HEADER_KEYWORDS["date"]): hits += 1
-            if _has_kw(cell, _HEADER_KEYWORDS["desc"]): hits += 1
-            if _has_kw(cell, _HEADER_KEYWORDS["amt"]):  hits += 1
-            if _has_kw(cell, _HEADER_KEYWORDS["dep"]):  hits += 1
-            if _has_kw(cell, _HEADER_KEYWORDS["wd"]):   hits += 1
-        if hits >= 2:
-            return i
-    return None
-
-def _parse_money(v) -> float:
-    if v is None or (isinstance(v, float) and pd.isna(v)):
-        return 0.0
-    s = re.sub(r"[₩원,\s]", "", str(v))
-    if s == "":
-        return 0.0
-    try:
-        return float(s)
-    except:
-        return 0.0
+    def money(key: str) -> np.ndarray:
+        nonlocal unparsable
+        if pos[key] is None:
+            return np.zeros(len(data), dtype=np.float64)
+        vals, bad = parse_money_series(_column_at(data, pos[key]))
+        unparsable += bad
+        return vals
 
-def unify_columns(df: pd.DataFrame) -> pd.DataFrame:
-    # 우리은행 자동 감지
-    woori = parse_woori_excel(df)
-    if woori is not None:
-        return woori
-    
-    # ✅ 국민은행 자동 감지
-    kb = parse_kb_excel(df)
-    if kb is not None:
-        return kb
-
-    df = df.dropna(how="all", axis=1)
-    df = df.dropna(how="all", axis=0).reset_index(drop=True)
-    idx = _guess_header_row(df)
-    if idx is None:
-        raise ValueError("헤더를 찾지 못했습니다.")
-
-    new_cols = [_norm_str(v) for v in df.iloc[idx].tolist()]
-    df = df.iloc[idx + 1:].copy()
-    df.columns = new_cols
-    df.reset_index(drop=True, inplace=True)
-
-    cols = list(df.columns)
-    col_date = next((c for c in cols if _has_kw(c, _HEADER_KEYWORDS["date"])), None)
-    col_desc = next((c for c in cols if _has_kw(c, _HEADER_KEYWORDS["desc"])), None)
-    col_dep  = next((c for c in cols if _has_kw(c, _HEADER_KEYWORDS["dep"])), None)
-    col_wd   = next((c for c in cols if _has_kw(c, _HEADER_KEYWORDS["wd"])), None)
-    col_amt  = next((c for c in cols if _has_kw(c, _HEADER_KEYWORDS["amt"])), None)
-
-    if not col_date or not col_desc:
-        raise ValueError(f"필수 컬럼 누락: {cols}")
-
-    if col_dep or col_wd:
-        dep_v = [_parse_money(a) for a in df[col_dep]] if col_dep else [0]*len(df)
-        wd_v  = [_parse_money(a) for a in df[col_wd]] if col_wd else [0]*len(df)
-        amount_series = [d - w for d, w in zip(dep_v, wd_v)]
-    elif col_amt:
-        amount_series = [_parse_money(a) for a in df[col_amt]]
+    if pos["dep"] is not None or pos["wd"] is not None:
+        amount = money("dep") - money("wd")
     else:
-        raise ValueError("금액 컬럼 없음")
+        amount = money("amt")
 
+    desc = _column_at(data, pos["desc"])
     out = pd.DataFrame({
-        "date": pd.to_datetime(df[col_date], errors="coerce"),
-        "description": df[col_desc],
-        "amount": amount_series
-    })
-    out = out[~(out["date"].isna() & (out["description"].astype(str).str.strip() == ""))]
-    out.reset_index(drop=True, inplace=True)
+        "date": pd.to_datetime(_column_at(data, pos["date"]), errors="coerce"),
+        "description": desc,
+        "amount": amount,
+    }, index=data.index)
 
     # ✅ 잔액 컬럼 자동 인식 (우리/국민 외 일반 엑셀 대비)
-    if '잔액' in df.columns or '거래후 잔액' in df.columns or '잔액(원)' in df.columns:
-        for c in ['잔액', '거래후 잔액', '잔액(원)']:
-            if c in df.columns:
-                out['balance'] = [_parse_money(v) for v in df[c]]
-                break
-    else:
-        out['balance'] = 0.0  # 기본값
+    out['balance'] = money("bal") if pos["bal"] is not None else 0.0
+
+    out = out[~(out["date"].isna() & (desc.astype(str).str.strip() == ""))]
+    out.attrs["unparsable_money"] = unparsable
     return out
 
+def _generic_plan(cells: List[str], tokens: List[frozenset], header_row) -> BatchTransform:
+    def find(key: str) -> Optional[int]:
+        return next((i for i, t in enumerate(tokens) if key in t), None)
+
+    pos = {k: find(k) for k in _GENERIC_KEYS}
+    pos["bal"] = next((cells.index(c) for c in _BALANCE_COLUMNS if c in cells), None)
+    if pos["bal"] is None:
+        pos["bal"] = find("bal")  # ✅ 이름이 다른 잔액 컬럼 (거래후잔액, 잔액(원) 등)
+
+    if pos["date"] is None or pos["desc"] is None:
+        raise ValueError(f"필수 컬럼 누락: {[c for c in cells if c not in ('', 'nan', 'None')]}")
+    if pos["dep"] is None and pos["wd"] is None and pos["amt"] is None:
+        raise ValueError("금액 컬럼 없음")
+
+    return lambda batch: _generic_transform(_rows_after(batch, header_row), pos)
+
+
+
+
+# =========================================
+# 4-B) 단일 패스 레이아웃 감지 (헤더 지문 + 레이아웃 인덱스)
+# =========================================
+_HEADER_RX: Optional[re.Pattern] = None
+_HEADER_GROUPS: List[str] = []
+# 첫 시그니처 토큰 → 레이아웃 번호: 행의 토큰으로 후보만 바로 찾는다 (포맷이 늘어나도 감지 비용 일정)
+_LAYOUT_INDEX: Dict[str, List[int]] = {}
+
+
+def _build_layout_index() -> None:
+    """범용 키워드 + 전체 레이아웃 시그니처를 하나의 정규식으로 컴파일하고 인덱스를 다시 만든다"""
+    global _HEADER_RX, _HEADER_GROUPS, _LAYOUT_INDEX
+
+    tokens = {k: "|".join(pats) for k, pats in _HEADER_KEYWORDS.items()}
+    index: Dict[str, List[int]] = {}
+    for i, layout in enumerate(BANK_LAYOUTS):
+        sig = layout["signature"]
+        for name, pat in sig.items():
+            if tokens.setdefault(name, pat) != pat:
+                raise ValueError(f"시그니처 토큰 '{name}' 정의 충돌 ({layout['name']})")
+        index.setdefault(next(iter(sig)), []).append(i)
+
+    # 모든 토큰을 위치마다 겹쳐서 검사 (입금액 → dep + amt 처럼 겹치는 키워드도 전부 잡힘)
+    _HEADER_RX = re.compile("".join(f"(?=(?P<{k}>{p}))?" for k, p in tokens.items()), re.I)
+    _HEADER_GROUPS = list(_HEADER_RX.groupindex)
+    _LAYOUT_INDEX = index
+    _cell_tokens.cache_clear()
+
+
+def register_layout(layout: Dict[str, Any], before: Optional[str] = None) -> None:
+    """레이아웃 추가 (before 지정 시 해당 레이아웃보다 우선, 시그니처 충돌 시 ValueError + 목록 그대로)"""
+    saved = list(BANK_LAYOUTS)
+    names = [l["name"] for l in BANK_LAYOUTS]
+    if layout["name"] in names:
+        BANK_LAYOUTS.pop(names.index(layout["name"]))
+        names.remove(layout["name"])
+    pos = names.index(before) if before in names else len(BANK_LAYOUTS)
+    BANK_LAYOUTS.insert(pos, layout)
+    try:
+        _build_layout_index()
+    except ValueError:
+        BANK_LAYOUTS[:] = saved
+        _build_layout_index()
+        raise
+
+
+@lru_cache(maxsize=4096)
+def _cell_tokens(cell: str) -> frozenset:
+    found = set()
+    for m in _HEADER_RX.finditer(cell):
+        for name, v in zip(_HEADER_GROUPS, m.groups()):
+            if v is not None:
+                found.add(name)
+    return frozenset(found)
+
+
+def _bank_candidates(row_tokens: frozenset) -> List[int]:
+    idx = {i for t in row_tokens for i in _LAYOUT_INDEX.get(t, ())}
+    return [i for i in sorted(idx) if row_tokens.issuperset(BANK_LAYOUTS[i]["signature"])]
+
+
+_build_layout_index()
+
+
+def _detect_plan(df: pd.DataFrame, only: Optional[str] = None) -> Tuple[str, Optional[BatchTransform]]:
+    """
+    앞부분 행을 한 번만 훑어 레이아웃 결정.
+    각 행의 셀을 _HEADER_RX 로 지문화 → 레이아웃 시그니처(앞 BANK_SCAN_ROWS 행)가 맞으면 전용 변환,
+    아니면 범용 키워드가 2개 이상 잡힌 첫 행(빈 행 제외 HEADER_SCAN_ROWS 행)을 헤더로 사용.
+    only 를 주면 해당 레이아웃만 찾고, 없으면 (only, None) 반환.
+    """
+    generic = None
+    seen = 0
+    for i in range(len(df)):
+        if i >= BANK_SCAN_ROWS and (generic is not None or seen >= HEADER_SCAN_ROWS):
+            break
+        cells = [_norm_str(v) for v in df.iloc[i].tolist()]
+        if all(c in ("", "nan", "None") for c in cells):
+            continue
+        seen += 1
+        tokens = [_cell_tokens(c) for c in cells]
+        row_tokens = frozenset().union(*tokens)
+
+        if i < BANK_SCAN_ROWS:
+            for li in _bank_candidates(row_tokens):
+                layout = BANK_LAYOUTS[li]
+                if only and layout["name"] != only:
+                    continue
+                plan = _layout_plan(layout, cells, df.index[i])
+                if plan is not None:
+                    return layout["name"], plan
+
+        if generic is None and seen <= HEADER_SCAN_ROWS:
+            hits = sum(len(t.intersection(_GENERIC_KEYS)) for t in tokens)
+            if hits >= 2:
+                generic = (cells, tokens, df.index[i])
+
+    if only:
+        return only, None
+    if generic is None:
+        raise ValueError("헤더를 찾지 못했습니다.")
+    return "generic", _generic_plan(*generic)
+
+
+def parse_woori_excel(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """우리은행 거래내역 파일 구조 감지 및 변환"""
+    _, plan = _detect_plan(df, only="woori")
+    return plan(df).reset_index(drop=True) if plan else None
+
+
+def parse_kb_excel(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """국민은행 거래내역 파일 구조 감지 및 변환"""
+    _, plan = _detect_plan(df, only="kb")
+    return plan(df).reset_index(drop=True) if plan else None
+
+
+def iter_unified(
+    batches: Iterable[pd.DataFrame],
+    scan_rows: int = HEADER_SCAN_ROWS,
+    meta: Optional[dict] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    iter_spreadsheet 배치를 받아 표준 컬럼(date, description, amount, balance ...) 배치로 변환.
+    앞부분 scan_rows 행만 모아 레이아웃을 한 번 감지하고, 이후 배치는 그대로 흘려보낸다.
+    meta 를 넘기면 금액으로 읽지 못한 셀 수를 meta["unparsable_money"] 에 누적.
+    """
+    it = iter(batches)
+    head: List[pd.DataFrame] = []
+    n = 0
+    for batch in it:
+        head.append(batch)
+        n += len(batch)
+        if n >= scan_rows:
+            break
+    if not head:
+        raise ValueError("빈 파일입니다.")
+
+    layout, plan = _detect_plan(pd.concat(head) if len(head) > 1 else head[0])
+    if meta is not None:
+        meta["layout"] = layout
+
+    def run(batch: pd.DataFrame) -> pd.DataFrame:
+        out = plan(batch)
+        if meta is not None:
+            meta["unparsable_money"] = meta.get("unparsable_money", 0) + out.attrs.get("unparsable_money", 0)
+        return out
+
+    for batch in head:
+        yield run(batch)
+    head = []  # 감지용 배치 참조 해제
+    for batch in it:
+        yield run(batch)
+
+def load_unified(
+    source,
+    filename: str,
+    batch_size: int = DEFAULT_BATCH_ROWS,
+    meta: Optional[dict] = None,
+) -> pd.DataFrame:
+    """스트리밍 로드 + 컬럼 통합 — 원본 시트 전체를 DataFrame 으로 올리지 않는다"""
+    batches = iter_spreadsheet(source, filename, batch_size, meta)
+    parts = [b for b in iter_unified(batches, meta=meta) if len(b)]
+    if not parts:
+        return pd.DataFrame(columns=["date", "description", "amount", "balance"])
+    return pd.concat(parts, ignore_index=True)
+
+def unify_columns(df: pd.DataFrame) -> pd.DataFrame:
+    _, plan = _detect_plan(df)
+    return plan(df).reset_index(drop=True)
+
 
 # =========================================
 # 5) 규칙 적용
@@ -360,3 +905,432 @@ def apply_rules(row: Dict[str, Any], rules: list) -> Dict[str, Any]:
             return result
 
     return result
+
+
+# =========================================
+# 5-B) 컴파일된 규칙 엔진 (DataFrame 단위 일괄 분류)
+# =========================================
+_RULE_FIELDS = ("description", "memo", "vendor")
+_RULE_FIELD_COLUMNS = {"description": "description", "memo": "memo", "vendor": "vendor_normalized"}
+_NO_MATCH = np.iinfo(np.int64).max
+
+
+class _KeywordMatcher:
+    """
+    키워드 → 규칙 순번 다중 패턴 매처.
+    텍스트 한 번 스캔으로 포함된 키워드 중 가장 작은 규칙 순번(=가장 높은 우선순위)을 찾는다.
+    """
+
+    def __init__(self, keywords: Dict[str, int]):
+        self._index = keywords
+        self._automaton = None
+        self._regex = None
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for kw, idx in keywords.items():
+                automaton.add_word(kw, idx)
+            automaton.make_automaton()
+            self._automaton = automaton
+        else:
+            # 순번 순서의 전방탐색 alternation → 각 위치에서 가장 우선인 키워드가 잡힌다
+            ordered = sorted(keywords, key=keywords.get)
+            self._regex = re.compile("(?=(" + "|".join(re.escape(k) for k in ordered) + "))")
+
+    def first(self, text: str) -> int:
+        best = _NO_MATCH
+        if self._automaton is not None:
+            for _, idx in self._automaton.iter(text):
+                if idx < best:
+                    best = idx
+        else:
+            for m in self._regex.finditer(text):
+                idx = self._index[m.group(1)]
+                if idx < best:
+                    best = idx
+        return best
+
+
+class CompiledRules:
+    """
+    사용자 규칙 목록(우선순위 정렬 상태)을 한 번 컴파일해 두고 DataFrame 전체를 컬럼 단위로 분류한다.
+    결과는 apply_rules 와 동일 (첫 번째로 매칭된 규칙 승리, category / category_l1~l3 / is_fixed).
+    """
+
+    def __init__(self, rules: list):
+        self.rules = list(rules or [])
+        per_field: Dict[str, Dict[str, int]] = {f: {} for f in _RULE_FIELDS}
+
+        for i, r in enumerate(self.rules):
+            kw = _safe_lower(r.get("keyword"))
+            tgt = (r.get("target") or "any").lower()
+            if not kw:
+                continue
+            fields = _RULE_FIELDS if tgt == "any" else ((tgt,) if tgt in _RULE_FIELDS else ())
+            for f in fields:
+                per_field[f].setdefault(kw, i)
+
+        self.matchers = {f: _KeywordMatcher(kws) for f, kws in per_field.items() if kws}
+
+        # 규칙 순번별 결과 테이블 (마지막 칸 = 미매칭 기본값)
+        n = len(self.rules)
+        self._category = np.empty(n + 1, dtype=object)
+        self._l1 = np.empty(n + 1, dtype=object)
+        self._l2 = np.empty(n + 1, dtype=object)
+        self._l3 = np.empty(n + 1, dtype=object)
+        self._fixed = np.zeros(n + 1, dtype=bool)
+        for i, r in enumerate(self.rules):
+            c1, c2, c3 = r.get("category_l1"), r.get("category_l2"), r.get("category_l3")
+            self._category[i] = r.get("category") or c3 or c2 or c1 or "미분류"
+            self._l1[i], self._l2[i], self._l3[i] = c1, c2, c3
+            self._fixed[i] = bool(r.get("is_fixed", False))
+        self._category[n] = "미분류"
+        self._l1[n] = self._l2[n] = self._l3[n] = None
+
+    def _field_hits(self, df: pd.DataFrame, field: str) -> np.ndarray:
+        """필드 컬럼의 고유값마다 한 번씩만 매칭 → 행 단위로 되돌림"""
+        col = _RULE_FIELD_COLUMNS[field]
+        if col not in df.columns:
+            return np.full(len(df), _NO_MATCH, dtype=np.int64)
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        matcher = self.matchers[field]
+        hits = np.fromiter(
+            (matcher.first(_safe_lower(u)) for u in uniques),
+            dtype=np.int64,
+            count=len(uniques),
+        )
+        hits = np.append(hits, _NO_MATCH)  # code -1 (NaN/None) → 미매칭
+        return hits[codes]
+
+    def match(self, df: pd.DataFrame) -> np.ndarray:
+        """행별로 매칭된 규칙 순번 (미매칭 = len(self.rules))"""
+        best = np.full(len(df), _NO_MATCH, dtype=np.int64)
+        for field in self.matchers:
+            np.minimum(best, self._field_hits(df, field), out=best)
+        return np.where(best == _NO_MATCH, len(self.rules), best)
+
+    def classify(self, df: pd.DataFrame, idx: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """idx: match() 결과를 이미 구했으면 재사용"""
+        if idx is None:
+            idx = self.match(df)
+
+        return pd.DataFrame(
+            {
+                "category": self._category[idx],
+                "category_l1": self._l1[idx],
+                "category_l2": self._l2[idx],
+                "category_l3": self._l3[idx],
+                "is_fixed": self._fixed[idx],
+            },
+            index=df.index,
+        )
+
+
+def compile_rules(rules: list) -> CompiledRules:
+    return CompiledRules(rules)
+
+
+def apply_rules_df(df: pd.DataFrame, rules) -> pd.DataFrame:
+    """
+    DataFrame 전체에 규칙 적용 (apply_rules 의 컬럼 단위 버전).
+    rules: 규칙 dict 목록 또는 compile_rules() 결과. 반환 DataFrame 의 index 는 df 와 동일.
+    """
+    compiled = rules if isinstance(rules, CompiledRules) else compile_rules(rules)
+    return compiled.classify(df)
+
+
+# =========================================
+# 6️⃣ 거래 지문 (중복 거래 판별)
+# =========================================
+def _money_key(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s, errors="coerce").fillna(0.0).round(2).map("{:.2f}".format)
+
+
+def transaction_fingerprints(df: pd.DataFrame, branch: str) -> pd.Series:
+    """
+    지점별 거래 지문: sha1(지점 | 거래일 | 금액 | 잔액 | 정규화 적요 | 같은 날 동일 거래 순번)
+    - 순번은 같은 날짜·금액·잔액·적요 조합 안에서의 파일 내 등장 순서 → 겹치는 기간을 다시 올려도 같은 지문
+    - 적요는 공백 정리 + 소문자 (은행 export 마다 다른 공백 차이 무시)
+    반환 Series 의 index 는 df 와 동일.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype=object)
+
+    day = pd.to_datetime(df["date"], errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+    amount = _money_key(df["amount"])
+    balance = _money_key(df["balance"]) if "balance" in df.columns else pd.Series("0.00", index=df.index)
+    desc = (
+        df["description"].fillna("").astype(str)
+        .str.replace(r"\s+", " ", regex=True).str.strip().str.lower()
+    )
+    key = branch.strip() + "|" + day + "|" + amount + "|" + balance + "|" + desc
+    ordinal = key.groupby(key, sort=False).cumcount().astype(str)
+    full = key + "|" + ordinal
+    return pd.Series(
+        [hashlib.sha1(k.encode("utf-8")).hexdigest() for k in full],
+        index=df.index,
+        dtype=object,
+    )
+
+
+# =========================================
+# 6️⃣-B 파싱 결과 캐시 (원본 내용 해시 → parquet)
+# =========================================
+PARSED_CACHE_VERSION = 1  # 파서 출력이 바뀌면 올려서 기존 캐시 무효화
+
+
+def evict_lru(directory: str, max_bytes: int, suffix: str = ".parquet") -> None:
+    """디렉터리 총 크기가 max_bytes 를 넘으면 가장 오래 안 쓴 파일(mtime)부터 삭제"""
+    try:
+        entries = [e for e in os.scandir(directory) if e.is_file() and e.name.endswith(suffix)]
+    except FileNotFoundError:
+        return
+    stats = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries))
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in stats:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+
+def _parsed_cache_path(cache_dir: str, content_hash: str) -> str:
+    return os.path.join(cache_dir, f"{content_hash}.v{PARSED_CACHE_VERSION}.parquet")
+
+
+def read_parsed_cache(cache_dir: Optional[str], content_hash: Optional[str], meta: Dict[str, Any]) -> Optional[pd.DataFrame]:
+    """캐시 적중 시 통합 DataFrame 반환 + meta 복원 (손상된 캐시는 지우고 None)"""
+    if not (cache_dir and content_hash):
+        return None
+    path = _parsed_cache_path(cache_dir, content_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception as e:
+        print(f"⚠️ 파싱 캐시 손상 → 삭제: {path} ({e})")
+        os.remove(path)
+        return None
+    os.utime(path)  # LRU 갱신
+    meta.update(df.attrs.pop("load_meta", {}))
+    meta["cache"] = "hit"
+    return df
+
+
+def write_parsed_cache(
+    cache_dir: Optional[str],
+    content_hash: Optional[str],
+    df: pd.DataFrame,
+    meta: Dict[str, Any],
+    max_bytes: int,
+) -> None:
+    if not (cache_dir and content_hash):
+        return
+    tmp = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _parsed_cache_path(cache_dir, content_hash)
+        # 호출마다 고유한 임시 파일 (같은 프로세스의 여러 스레드가 같은 내용을 파싱해도 충돌 없음)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=f"{content_hash}.", suffix=".tmp")
+        os.close(fd)
+        out = df.copy(deep=False)
+        out.attrs = {"load_meta": {k: v for k, v in meta.items() if k in ("format", "layout", "unparsable_money")}}
+        out.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        evict_lru(cache_dir, max_bytes)
+    except Exception as e:
+        print(f"⚠️ 파싱 캐시 저장 실패: {e}")
+    finally:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# =========================================
+# 7️⃣ 업로드 1건 전처리 (파싱 → 분류 → 지문)
+# =========================================
+def _drop_undated(df: pd.DataFrame) -> pd.DataFrame:
+    mask = df["date"].notna()
+    return df if mask.all() else df[mask].copy()
+
+
+def _clean_unified(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    숫자 컬럼의 ±inf → NaN, memo 빈칸 채움, 날짜 없는 행 제거.
+    프레임 전체 replace / 무조건 copy 는 하지 않는다 (문자열 컬럼은 Arrow 그대로 유지).
+    """
+    for c in df.columns:
+        if pd.api.types.is_float_dtype(df[c]):
+            df[c] = df[c].replace([np.inf, -np.inf], np.nan)
+    if "memo" not in df.columns:
+        df["memo"] = ""
+    else:
+        df["memo"] = df["memo"].fillna("")
+    df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0)
+    return _drop_undated(df)
+
+
+def _classify_unified(df: pd.DataFrame, rules) -> pd.DataFrame:
+    df["vendor_normalized"] = normalize_vendor_series(df["description"])
+    applied = apply_rules_df(df, rules)
+    for c in applied.columns:  # concat(axis=1) 대신 컬럼만 붙여 전체 복사 방지
+        df[c] = applied[c]
+
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    return _drop_undated(df)
+
+
+def prepare_statement(
+    source,
+    filename: str,
+    branch: str,
+    rules,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    on_phase: Optional[Callable[[str], None]] = None,
+    content_hash: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: int = 1024 ** 3,
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    업로드 1건의 CPU 작업 묶음: 로드 → 정리 → 기간 필터 → 벤더 정규화/규칙 분류 → 월 컬럼/지문
+    - source: 파일 경로(str) / bytes / 파일 객체 — 경로로 넘기면 프로세스 풀에서도 호출 가능
+    - rules: 규칙 dict 목록 또는 compile_rules() 결과
+    - content_hash + cache_dir 지정 시 통합 DataFrame 을 parquet 캐시에서 읽고/저장 (적중 시 파싱 생략)
+    - 파일 읽기 실패 / 기간 내 거래 없음 → ValueError
+    반환: (df, meta)  meta = format / layout / unparsable_money / rows_parsed
+    """
+    phase = on_phase or (lambda _: None)
+    meta: Dict[str, Any] = {}
+
+    # 1️⃣ 로드 + 컬럼 정규화 (배치 스트리밍 → 원본 시트 전체를 메모리에 올리지 않음)
+    phase("parsing")
+    df = read_parsed_cache(cache_dir, content_hash, meta)
+    if df is None:
+        try:
+            if isinstance(source, str):
+                with open(source, "rb") as fh:
+                    df = load_unified(fh, filename, meta=meta)
+            else:
+                df = load_unified(source, filename, meta=meta)
+        except Exception as e:
+            raise ValueError(f"파일 읽기 오류: {e}")
+        write_parsed_cache(cache_dir, content_hash, df, meta, cache_max_bytes)
+    meta["rows_parsed"] = len(df)
+    print(
+        f"📄 [{branch}] {filename} → 포맷={meta.get('format')}, "
+        f"레이아웃={meta.get('layout')}, {len(df)}행, "
+        f"금액 인식 실패 {meta.get('unparsable_money', 0)}칸"
+        + (" (캐시)" if meta.get("cache") == "hit" else "")
+    )
+
+    df = _clean_unified(df)
+
+    # 2️⃣ 기간 지정 필터 (선택적)
+    if start_month and end_month:
+        start_date = pd.to_datetime(f"{start_month}-01")
+        end_date = pd.Period(end_month).end_time
+        before = len(df)
+        df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
+        print(f"🗓️ 기간 필터 적용: {start_month} ~ {end_month} ({before} → {len(df)}건)")
+    else:
+        print("🗓️ 단일 월 업로드로 처리")
+
+    if df.empty:
+        raise ValueError("선택된 기간에 해당하는 거래내역이 없습니다.")
+
+    # 3️⃣ 규칙 적용 (규칙 1회 컴파일 → 컬럼 단위 일괄 분류)
+    phase("classifying")
+    df = _classify_unified(df, rules)
+
+    # 4️⃣ 월 컬럼 + 거래 지문
+    df["year"] = df["date"].dt.year
+    df["month"] = df["date"].dt.month
+    df["fingerprint"] = transaction_fingerprints(df, branch)
+    return df, meta
+
+
+# =========================================
+# 8️⃣ 처리 결과 파일 출력 (csv / xlsx / parquet)
+# =========================================
+OUTPUT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _xlsx_column(s: pd.Series) -> list:
+    """컬럼 단위로 openpyxl 이 받는 파이썬 값 목록으로 변환 (NaN/NaT → None)"""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        values = np.array(s.dt.to_pydatetime(), dtype=object)
+    else:
+        values = s.to_numpy(dtype=object, copy=True)
+    values[pd.isna(s).to_numpy()] = None
+    return values.tolist()
+
+
+def write_xlsx_streaming(df: pd.DataFrame, sheet_name: str = "transactions") -> bytes:
+    """openpyxl write-only 모드: 셀 객체를 쌓지 않고 행 단위로 바로 직렬화 (메모리 일정)"""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(c) for c in df.columns])
+    for start in range(0, len(df), DEFAULT_BATCH_ROWS):
+        part = df.iloc[start:start + DEFAULT_BATCH_ROWS]
+        for row in zip(*(_xlsx_column(part[c]) for c in part.columns)):
+            ws.append(row)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+EXPORT_INTERNAL_COLUMNS = ("fingerprint", "year", "month", "vendor_normalized")
+
+
+def export_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """처리 결과 파일용: 저장/분류에만 쓰는 내부 컬럼 제거"""
+    return df.drop(columns=[c for c in EXPORT_INTERNAL_COLUMNS if c in df.columns])
+
+
+def render_frame(df: pd.DataFrame, fmt: str) -> bytes:
+    """처리 결과 DataFrame → 파일 bytes (fmt: csv | xlsx | parquet)"""
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8-sig")  # 엑셀에서 한글 깨짐 방지 BOM
+    if fmt == "parquet":
+        out = io.BytesIO()
+        df.to_parquet(out, index=False)
+        return out.getvalue()
+    if fmt == "xlsx":
+        return write_xlsx_streaming(df)
+    raise ValueError(f"지원하지 않는 출력 형식: {fmt}")
+
+
+def iter_preview(
+    source,
+    filename: str,
+    rules,
+    limit: int,
+    meta: Optional[dict] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    미리보기(드라이런): 감지 → 정리 → 분류된 배치를 앞에서부터 limit 행까지만 반환.
+    limit 행을 채우면 원본 읽기를 즉시 중단 (나머지 행은 파싱하지 않음).
+    """
+    batch_size = max(HEADER_SCAN_ROWS, min(limit, DEFAULT_BATCH_ROWS))
+    batches = iter_unified(iter_spreadsheet(source, filename, batch_size, meta), meta=meta)
+    remaining = limit
+    try:
+        for batch in batches:
+            batch = _clean_unified(batch).iloc[:remaining]
+            if batch.empty:
+                continue
+            batch = _classify_unified(batch, rules)
+            remaining -= len(batch)
+            yield batch
+            if remaining <= 0:
+                break
+    finally:
+        batches.close()